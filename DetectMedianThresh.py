@@ -15,6 +15,7 @@ Press 'q' to quit
 Use the '+' and '-' keys to change object detect threshold by 1
 Old shift while pressing '+' or '-' to change threshould by 10
 
+V2 10.18.26 detections saved with detections.DetectionTable, written to the file as it fills instead of growing detectArray with np.append
 11/15/2022 Tom Zimmerman CCC, IBM Research 
 This work is funded by the National Science Foundation (NSF) grant No. DBI-1548297, Center for Cellular Construction.
 Disclaimer:  Any opinions, findings and conclusions or recommendations expressed in this material are those of the authors and do not necessarily reflect the views of the National Science Foundation.
@@ -23,12 +24,14 @@ Disclaimer:  Any opinions, findings and conclusions or recommendations expressed
 ############################## FOR EDUCATIONAL USE ONLY ####################
 import numpy as np
 import cv2
+import detections       # detection table, written to the detection file as it fills
 
 ########## USER SETTINGS ##############################
 vid=r'C:\Users\820763897\Videos\microscope\WhiteLightEdit\PlanktonWhiteLight.mp4'    
 vid=r'C:\Users\820763897\Videos\microscope\WhiteLightEdit\planktonWhiteLight_960_544.mp4'  
 vid=r'C:\Users\820763897\Videos\microscope\Hologram\SFSU_Plankton_Videos\BLE_AMM_6.mp4'
 detectFileName='test.csv'
+detectNpyName='test.npy'     # same detections as a binary file, keeps AR and ANGLE fractions, see detections.py
 
 medianFrames=25 # number of random frames to calculate median frame brightness
 skipFrames=100  # give video image autobrightness (AGC) time to settle
@@ -43,7 +46,7 @@ PROCESS_REZ=(320,240)   # processing resolution, video frames reduced in size to
 ############# DETECT OUTPUT ##################
 detectHeader= 'FRAME,ID,X0,Y0,X1,Y1,XC,YC,AREA,AR,ANGLE'
 FRAME=0; ID=1;  X0=2;   Y0=3;   X1=4;   Y1=5;   XC=6;   YC=7; AREA=8; AR=9; ANGLE=10; MAX_COL=11
-detectArray=np.empty((0,MAX_COL), dtype='int') # cast as int since most features are int and it simplifies usage
+detectTable=detections.DetectionTable(detectFileName,npyName=detectNpyName) # detection features of each object, saved to detectFileName as the table fills
 
 def getMedian(vid,medianFrames,TINY_REZ):
     # Open Video
@@ -121,7 +124,7 @@ while(cap.isOpened()):
     contourList, hierarchy = cv2.findContours(binaryIM, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE) # all countour points, uses more memory
     
     # draw bounding boxes around objects
-    objCount=0      # used as object ID in detectArray
+    objCount=0      # used as object ID in detectTable
     for objContour in contourList:                  # process all objects in the contourList
         area = int(cv2.contourArea(objContour))     # find obj area        
         if area>MIN_AREA:                           # only detect large objects       
@@ -131,9 +134,8 @@ while(cap.isOpened()):
             cv2.rectangle(binaryIM, (x0,y0), (x1,y1), 255, 1) # place white rectangle around each object
             (xc,yc,ar,angle)=getAR(objContour)
 
-            # save object parameters in detectArray in format FRAME=0; ID=1;  X0=2;   Y0=3;   X1=4;   Y1=5;   XC=6;   YC=7; CLASS=8; AREA=9; AR=10; ANGLE=11; MAX_COL=12
-            parm=np.array([[frameCount,objCount,x0,y0,x1,y1,xc,yc,area,ar,angle]],dtype='int') # create parameter vector (1 x MAX_COL) 
-            detectArray=np.append(detectArray,parm,axis=0)  # add parameter vector to bottom of detectArray, axis=0 means add row
+            # save object parameters in detectTable in format FRAME=0; ID=1;  X0=2;   Y0=3;   X1=4;   Y1=5;   XC=6;   YC=7; CLASS=8; AREA=9; AR=10; ANGLE=11; MAX_COL=12
+            detectTable.add([frameCount,objCount,x0,y0,x1,y1,xc,yc,area,ar,angle])  # add parameter vector to bottom of detectTable
             objCount+=1                                     # indicate processed an object
     print('thresh:',THRESH,'frame:',frameCount,'all objects:',len(contourList),'big objects:',objCount)
 
@@ -146,7 +148,7 @@ while(cap.isOpened()):
 
 if frameCount>0:
     print('Done with video. Saving feature file and exiting program')
-    np.savetxt(detectFileName,detectArray,header=detectHeader,delimiter=',', fmt='%d')
+    detectTable.close()   # save rows not written yet
     cap.release()
 else:
     print('Count not open video',vid)
@@ -7,6 +7,9 @@ This code matches the object in a second frame to the closest object in the firs
 
 For HW6 Task 3 you need to modify this code so it works over all the frames in the video and saves the modified data array at track.csv (hint, use np.savetxt() command)
 I've also included a flag ASSIGNED you can use so you don't assign an ID to more than one object.
+To go through all the frames use: for frame,frameData in store.iterFrames()
+
+V2 10.18.26 Rows of a frame come from detections.DetectionStore instead of searching the whole table with np.where
 
 Thomas Zimmerman, IBM Research-Almaden
 This work is funded by the National Science Foundation (NSF) grant No. DBI-1548297, Center for Cellular Construction.
@@ -15,6 +18,7 @@ Disclaimer:  Any opinions, findings and conclusions or recommendations expressed
 
 import numpy as np
 import math
+import detections   # frame indexed detection store
 
 detectFileName='detection.csv'      # output file containing object location, area, aspect ratio for each video frame
 FRAME=0; ID=1;  X0=2;   Y0=3;   X1=4;   Y1=5;   XC=6;   YC=7; AREA=8; AR=9; ANGLE=10; MAX_COL=11 # pointers to detection features
@@ -27,17 +31,17 @@ def distance(x2,y2,x1,y1):
 
 #################### MAIN ####################
 data=np.loadtxt(detectFileName,delimiter=',',skiprows=1)
+store=detections.DetectionStore(data)  # sorts rows by frame once and remembers where each frame starts
+data=store.data     # same rows in frame order
 print('data shape',data.shape)
 
-maxFrames=len(np.unique(data[:,FRAME]))
+maxFrames=store.frameCount
 print('max frames',maxFrames)
 
 # get index of all rows with the frame we are interested in
-# np.where returns a tuple containing an array, so we get to the array by rquesting the first element of the tuple with [0]
-# for a detailed explaination of why np.where returns a tuple, see https://stackoverflow.com/questions/50646102/what-is-the-purpose-of-numpy-where-returning-a-tuple
-a=np.where(data[:,FRAME]==1)
-f1=np.where(data[:,FRAME]==1)[0]
-f2=np.where(data[:,FRAME]==2)[0]
+# same rows as np.where(data[:,FRAME]==1)[0], but without searching the whole table for every frame
+f1=store.rows(1)
+f2=store.rows(2)
 print('objects in frame2=',len(f1),'objects in frame1=',len(f1),'\n')
       
 # create an array to store all the distances and ID's for all combinations of objects in frame 2 and 1
@@ -0,0 +1,200 @@
+'''
+Automatic focus, finds the reconstruction Z of a hologram without pressing +/- and watching the contrast
+
+findBestZ() first reconstructs Z values COARSE_STEP apart over the whole range (one forward FFT for all of them),
+then narrows down around the best REFINE_PEAKS coarse peaks with a golden-section search and keeps the best.
+Focus curves of holograms have several peaks, so the coarse step has to be small enough not to jump over the
+real one, 100 um needs about a fifth of the reconstructions of a sweep of every 20 um step.
+Focus metrics are pluggable, bigger values mean sharper images:
+    'line'      contrast (max-min)/(max+min) along the middle row, like findZ_line.py
+    'contrast'  contrast (max-min)/(max+min) of the whole image, use with a line roi to match streamRecoLine.py
+    'gabor'     magnitude of the variance of 0 and 90 deg Gabor filtered images, like focusGabor.py
+    'tamura'    Tamura coefficient sqrt(std/mean)
+    'gradient'  mean squared intensity gradient (gradient energy)
+A metric can also be any function that takes a uint8 image and returns a number.
+Close to z=0 the raw hologram fringes also look sharp, so start the search range above the sensor cover glass.
+
+gaborStack() scores a whole stack of images at once. The filtering is a multiplication by the kernel spectra
+(cached per image size) and the variance comes straight from the spectrum (Parseval), so no inverse FFT is needed.
+
+Passing roi=[y0,y1,x0,x1] to findBestZ or scanZ scores only that region, which is reconstructed on its own with
+reco.recoROIFromE0, so following one cell or one line in a big field doesn't cost a full frame per z.
+
+Usage
+bestZ,score=autofocus.findBestZ(cropIM,1000e-6,6000e-6,'gabor')   # z in meters, same as reco.recoFrame
+bestZ,score=autofocus.findBestZ(grayIM,1000e-6,6000e-6,'contrast',roi=[150,350,410,411])   # vertical line at x=410
+
+V1 10.18.26
+V2 10.18.26 coarse search uses a fixed Z step instead of a fixed number of steps and refines the best few peaks
+V3 10.18.26 Z search kernels are not cached, search z values are only used once and would push out the display kernels
+V4 10.18.26 gaborZScan scores each reconstructed chunk as it is made instead of restacking its planes
+Thomas Zimmerman, IBM Research-Almaden
+This work is funded by the National Science Foundation (NSF) grant No. DBI-1548297, Center for Cellular Construction.
+Disclaimer:  Any opinions, findings and conclusions or recommendations expressed in this material are those of the authors and do not necessarily reflect the views of the National Science Foundation.
+'''
+
+import numpy as np
+import scipy.fft
+import reco                 # performs reconstruction
+
+COARSE_STEP=100e-6  # spacing of the Z values tried over the whole range before narrowing down (meters)
+REFINE_PEAKS=3      # coarse peaks searched with golden-section, the best one wins
+Z_TOL=20e-6         # stop when the best Z is known to within this distance (meters)
+GABOR_FREQUENCY=0.35    # Gabor filter settings, same as focusGabor.py
+GABOR_SIGMA=1
+GABOR_CHUNK=32          # images filtered together by gaborStack, limits memory
+GABOR_WORKERS=-1        # FFT threads used by gaborStack, -1 uses all cores
+GOLDEN=(np.sqrt(5)-1)/2 # 0.618, golden-section ratio
+
+gaborKernels=None   # (kernel0,kernel90), made the first time the gabor metric is used
+gaborSpectra={}     # (rows,columns) -> spectra of the Gabor kernels for that image size
+
+################# FOCUS METRICS #################
+def lineContrast(im):
+    line=im[im.shape[0]//2,:].astype(float)     # middle row
+    iMin=line.min(); iMax=line.max()
+    if iMax+iMin==0:
+        return(0.0)
+    return((iMax-iMin)/(iMax+iMin))
+
+def getGaborKernels():
+    global gaborKernels
+    if gaborKernels is None:
+        from skimage.filters import gabor_kernel
+        kernels=[]
+        for theta in (0,90):    # same angles as focusGabor.py
+            angle=theta/4.*np.pi
+            kernels.append(np.real(gabor_kernel(GABOR_FREQUENCY,theta=angle,sigma_x=GABOR_SIGMA,sigma_y=GABOR_SIGMA)))
+        gaborKernels=tuple(kernels)
+    return(gaborKernels)
+
+def getGaborSpectra(M,N):
+    # rfft2 of the Gabor kernels, centered on pixel 0,0 so multiplying spectra is the same as ndi.convolve(mode='wrap')
+    if (M,N) not in gaborSpectra:
+        spectra=[]
+        for kernel in getGaborKernels():
+            (kRows,kCols)=kernel.shape
+            rows=(np.arange(kRows)-kRows//2)%M
+            cols=(np.arange(kCols)-kCols//2)%N
+            padded=np.zeros((M,N))
+            np.add.at(padded,(rows[:,np.newaxis],cols[np.newaxis,:]),kernel) # also works for kernels bigger than the image
+            spectra.append(scipy.fft.rfft2(padded))
+        gaborSpectra[(M,N)]=np.stack(spectra)
+    return(gaborSpectra[(M,N)])
+
+def gaborStack(stack):
+    # Gabor focus value of every image in stack (images,rows,columns), returns (scores,index of best image)
+    stack=np.asarray(stack)
+    if stack.ndim==2:
+        stack=stack[np.newaxis]
+    (K,M,N)=stack.shape
+    spectra=getGaborSpectra(M,N)
+
+    # rfft2 only keeps columns 0..N/2, the others are mirror images so they count twice in the sums
+    weight=np.full(N//2+1,2.0)
+    weight[0]=1
+    if N%2==0:
+        weight[-1]=1
+
+    scores=np.zeros(K)
+    for i in range(0,K,GABOR_CHUNK):
+        X=scipy.fft.rfft2(stack[i:i+GABOR_CHUNK].astype(np.float32),workers=GABOR_WORKERS)
+        G=X[:,np.newaxis]*spectra                   # filtered images [image,kernel,rows,columns/2]
+        power=np.abs(G)**2
+        sumSquares=(power*weight).sum(axis=(-2,-1))/(M*N)   # Parseval, sum of filtered image squared
+        mean=G[...,0,0].real/(M*N)                  # DC term is the sum of the filtered image
+        var=sumSquares/(M*N)-mean**2                # variance of each filtered image
+        scores[i:i+GABOR_CHUNK]=np.sqrt(var[:,0]**2+var[:,1]**2)
+    return(scores,int(np.argmax(scores)))
+
+def gaborZScan(cropIM,zList,chunk=reco.STACK_CHUNK):
+    # Gabor focus value of cropIM reconstructed at every z in zList, returns (scores,index of best z)
+    # only one chunk of reconstructed planes is in memory at a time, each chunk is scored as it is made
+    E0=reco.recoE0(cropIM)      # one forward FFT for every z
+    scores=[]
+    for zChunk,ampStack in reco.iterRecoChunks(E0,zList,reco.recoShape(cropIM),chunk):
+        scores.append(gaborStack(ampStack)[0])
+    scores=np.concatenate(scores) if len(scores)>0 else np.zeros(0)
+    return(scores,int(np.argmax(scores)) if len(scores)>0 else -1)
+
+def gaborVariance(im):
+    scores,best=gaborStack(im)
+    return(scores[0])
+
+def contrast(im):
+    iMin=float(im.min()); iMax=float(im.max())
+    if iMax+iMin==0:
+        return(0.0)
+    return((iMax-iMin)/(iMax+iMin))
+
+def tamura(im):
+    im=im.astype(float)
+    mean=im.mean()
+    if mean==0:
+        return(0.0)
+    return(np.sqrt(im.std()/mean))
+
+def gradientEnergy(im):
+    im=im.astype(float)
+    gy,gx=np.gradient(im)
+    return(np.mean(gx*gx+gy*gy))
+
+METRICS={'line':lineContrast, 'contrast':contrast, 'gabor':gaborVariance, 'tamura':tamura, 'gradient':gradientEnergy}
+
+def getMetric(metric):
+    if callable(metric):
+        return(metric)
+    return(METRICS[metric])
+
+################# Z SEARCH #################
+def scanZ(cropIM,zList,metric='line',roi=None):
+    # focus score of every z in zList, one forward FFT for all of them
+    focus=getMetric(metric)
+    if roi is not None:
+        E0=reco.recoE0(cropIM)
+        return(np.array([focus(reco.recoROIFromE0(E0,z,roi)) for z in zList]))
+    return(np.array([focus(ampIM) for z,ampIM in reco.iterRecoStack(cropIM,zList)]))
+
+def findPeaks(scores,count):
+    # index of the count highest local maxima of scores, best first
+    scores=np.asarray(scores)
+    left=np.concatenate(([-np.inf],scores[:-1]))
+    right=np.concatenate((scores[1:],[-np.inf]))
+    peaks=np.flatnonzero((scores>=left)&(scores>=right))
+    return(peaks[np.argsort(scores[peaks])[::-1][:count]])
+
+def findBestZ(cropIM,zMin,zMax,metric='line',coarseStep=COARSE_STEP,tol=Z_TOL,roi=None,refinePeaks=REFINE_PEAKS):
+    # returns (bestZ,bestScore) of cropIM between zMin and zMax (meters), roi=[y0,y1,x0,x1] only scores that region
+    focus=getMetric(metric)
+    E0=reco.recoE0(cropIM)      # forward FFT only depends on the image, so do it once
+    shape=reco.recoShape(cropIM)
+    scores={}                   # z -> score, never reconstruct the same z twice
+    def score(z):
+        if z not in scores:
+            if roi is None:
+                scores[z]=focus(reco.recoFromE0(E0,z,shape,cache=False))  # every z is new, keep the kernel cache for the display
+            else:
+                scores[z]=focus(reco.recoROIFromE0(E0,z,roi))
+        return(scores[z])
+
+    # coarse search over the whole range
+    steps=max(int(np.ceil((zMax-zMin)/coarseStep)),1)+1
+    zList=np.linspace(zMin,zMax,steps)
+    if roi is None:
+        for z,ampIM in reco.iterRecoFromE0(E0,zList,shape):   # same E0, planes reconstructed a chunk at a time
+            scores[z]=focus(ampIM)
+    coarse=[score(z) for z in zList]
+
+    # golden-section search for each of the best coarse peaks, between the neighbours of the peak
+    for best in findPeaks(coarse,refinePeaks):
+        a=zList[max(best-1,0)]
+        b=zList[min(best+1,len(zList)-1)]
+        c=b-GOLDEN*(b-a)
+        d=a+GOLDEN*(b-a)
+        while b-a>tol:
+            if score(c)>score(d):
+                b=d; d=c; c=b-GOLDEN*(b-a)
+            else:
+                a=c; c=d; d=a+GOLDEN*(b-a)
+    bestZ=max(scores,key=scores.get)
+    return(bestZ,scores[bestZ])
@@ -0,0 +1,168 @@
+'''
+Batch reconstruction of holographic videos from the command line, no display needed
+
+Reconstructs every Nth frame (or frame ranges) of one or many mp4 videos at one or several Z values.
+Each video is decoded in order (no seeking for every frame) and several videos are processed at the same time, one per process.
+Progress is saved after every frame so a stopped run continues where it left off when started again with the same options.
+Every set of options (z values, --every, --frames, --window) has its own progress file, M6_<options>_progress.txt,
+so a run with other options starts from the beginning instead of skipping frames that were never reconstructed.
+
+Output images are saved in the output directory, format= M6_23_3000_reco.jpg where:
+        "M6" is from the video name
+        "23" is frame number
+        "3000" is the z value (distance between object and image sensor (in microns)
+
+Examples
+python batchReco.py M6.mp4 --z 3000
+python batchReco.py rawVideo\\*.mp4 --z 2800 3000 3200 --every 10 --out recoImage --workers 4
+python batchReco.py M6.mp4 --z 3000 --frames 0-500,2000-2500 --window 268,668,882,1282
+
+V1 10.18.26
+V2 10.18.26 progress file name includes a hash of the options, resuming with other z values or frames no longer skips work
+Thomas Zimmerman, IBM Research-Almaden
+Holgraphic Reconstruction Algorithms by Nick Antipac, UC Berkeley and  Daniel Elnatan, UCSF
+This work is funded by the National Science Foundation (NSF) grant No. DBI-1548297, Center for Cellular Construction.
+Disclaimer:  Any opinions, findings and conclusions or recommendations expressed in this material are those of the authors and do not necessarily reflect the views of the National Science Foundation.
+'''
+
+import argparse
+import glob
+import hashlib
+import os
+import time
+import cv2
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import reco                 # performs reconstruction
+
+########## DEFAULT SETTINGS ##############################
+Z_SCALE=1e-6                # convert z units to microns
+OUT_DIR='recoImage'         # where reconstructed images are saved
+WORKERS=os.cpu_count()      # videos processed at the same time
+PROGRESS_SUFFIX='_progress.txt'   # holds the last finished frame of a video for one set of options, used to resume
+
+################# FUNCTIONS #################
+def parseRanges(text):
+    # '0-500,2000-2500,3000' -> [(0,500),(2000,2500),(3000,3000)], frame numbers are inclusive
+    ranges=[]
+    for part in text.split(','):
+        if '-' in part:
+            first,last=part.split('-')
+            ranges.append((int(first),int(last)))
+        else:
+            ranges.append((int(part),int(part)))
+    return(sorted(ranges))
+
+def findVideos(names):
+    # expand file names, wildcards and directories into a list of mp4 files
+    videos=[]
+    for name in names:
+        if os.path.isdir(name):
+            name=os.path.join(name,'*.mp4')
+        videos+=sorted(glob.glob(name))
+    return([v for v in videos if v.lower().endswith('.mp4')])
+
+def getProgressName(outDir,vid,zList,every,ranges,window):
+    # progress file of a video for these options, other options have another file and start from frame 0
+    options=repr((sorted(zList),every,ranges,window))
+    key=hashlib.md5(options.encode()).hexdigest()[:8]
+    prefix=os.path.splitext(os.path.basename(vid))[0]
+    return(os.path.join(outDir,prefix+'_'+key+PROGRESS_SUFFIX))
+
+def readProgress(progressName):
+    if os.path.isfile(progressName):
+        with open(progressName) as f:
+            return(int(f.read()))
+    return(-1)
+
+def saveProgress(progressName,frameCount):
+    with open(progressName+'.tmp','w') as f:
+        f.write(str(frameCount))
+    os.replace(progressName+'.tmp',progressName)    # never leave a half written progress file
+    return
+
+def recoVideo(vid,zList,every,ranges,window,outDir):
+    # reconstruct one video, returns (video, frames reconstructed, seconds)
+    startTime=time.time()
+    prefix=os.path.splitext(os.path.basename(vid))[0]
+    progressName=getProgressName(outDir,vid,zList,every,ranges,window)
+    lastDone=readProgress(progressName)
+
+    cap=cv2.VideoCapture(vid)
+    if not cap.isOpened():
+        print('Could not open video file:',vid)
+        return(vid,0,0)
+    maxFrame=int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    if ranges is None:
+        ranges=[(0,maxFrame-1)]
+
+    frames=0
+    position=0                  # frame the next cap.read() returns
+    for first,last in ranges:
+        first=max(first,lastDone+1)
+        first+=(-first)%every   # keep every Nth frame counted from 0 so a resumed run picks the same frames
+        last=min(last,maxFrame-1)
+        if first>last:
+            continue
+        if first!=position:
+            cap.set(cv2.CAP_PROP_POS_FRAMES,first)  # one seek per range, then decode in order
+            position=first
+        for frameCount in range(first,last+1):
+            if frameCount%every!=0:
+                ok=cap.grab()   # skipped frames are not converted to images
+            else:
+                ok,rawIM=cap.read()
+                if ok:
+                    grayIM=cv2.cvtColor(rawIM,cv2.COLOR_BGR2GRAY)
+                    if window is not None:
+                        grayIM=grayIM[window[0]:window[1],window[2]:window[3]] # crop window of image
+                    stack=reco.recoStack(grayIM,[z*Z_SCALE for z in zList]) # one forward FFT for all z
+                    for z,recoIM in zip(zList,stack):
+                        cv2.imwrite(os.path.join(outDir,prefix+'_'+str(frameCount)+'_'+str(z)+'_reco.jpg'),recoIM)
+                    saveProgress(progressName,frameCount)
+                    frames+=1
+            if not ok:
+                break
+            position+=1
+    cap.release()
+    return(vid,frames,time.time()-startTime)
+
+def getArgs():
+    parser=argparse.ArgumentParser(description='Reconstruct holographic mp4 videos without a display')
+    parser.add_argument('videos',nargs='+',help='mp4 files, wildcards or directories')
+    parser.add_argument('--z',nargs='+',type=int,required=True,help='reconstruction z values (microns)')
+    parser.add_argument('--every',type=int,default=1,help='reconstruct every Nth frame')
+    parser.add_argument('--frames',type=parseRanges,default=None,help='frame ranges, e.g. 0-500,2000-2500')
+    parser.add_argument('--window',default=None,help='crop window y0,y1,x0,x1 of the full frame')
+    parser.add_argument('--out',default=OUT_DIR,help='output directory')
+    parser.add_argument('--workers',type=int,default=WORKERS,help='videos processed at the same time')
+    parser.add_argument('--restart',action='store_true',help='ignore saved progress for these options and start from the beginning')
+    args=parser.parse_args()
+    if args.window is not None:
+        args.window=[int(v) for v in args.window.split(',')]
+    return(args)
+
+################################ MAIN ##################################
+if __name__=='__main__':   # needed so processes started by the pool don't rerun the main program
+    args=getArgs()
+    videos=findVideos(args.videos)
+    if len(videos)==0:
+        print('No mp4 videos found')
+    os.makedirs(args.out,exist_ok=True)
+    if args.restart:
+        for vid in videos:
+            progressName=getProgressName(args.out,vid,args.z,args.every,args.frames,args.window)
+            if os.path.isfile(progressName):
+                os.remove(progressName)
+
+    startTime=time.time()
+    totalFrames=0
+    with ProcessPoolExecutor(max_workers=min(args.workers,max(len(videos),1))) as pool:
+        jobs=[pool.submit(recoVideo,vid,args.z,args.every,args.frames,args.window,args.out) for vid in videos]
+        for job in as_completed(jobs):
+            vid,frames,seconds=job.result()
+            totalFrames+=frames
+            rate=frames/seconds if seconds>0 else 0
+            print('Done',vid,frames,'frames in',round(seconds,1),'seconds,',round(rate,1),'frames/s')
+    seconds=time.time()-startTime
+    if seconds>0:
+        print('All videos:',totalFrames,'frames in',round(seconds,1),'seconds,',round(totalFrames/seconds,1),'frames/s,',round(totalFrames*len(args.z)/seconds,1),'images/s')
@@ -7,6 +7,8 @@ Press 't' to select threshold. Press '+' and '-' to change value by increments o
 Hold shift while pressing '+' or '-' to change value by increments of 10. 
 Press 'q' to quit
 
+v4 10.18.26 online tracking, objects are tracked frame by frame as they are detected and saved to track.csv (ONLINE_TRACKING, off by default)
+v3 10.18.26 detections saved with detections.DetectionTable, written to the file as it fills instead of growing detectArray with np.append
 v2 09.02.2021 Uses keyboard to change variables
 v1 08.31.2020
 
@@ -16,12 +18,17 @@ Disclaimer:  Any opinions, findings and conclusions or recommendations expressed
 '''
 import numpy as np
 import cv2
+import detections       # detection table, written to the detection file as it fills
 import keyboard as k     # reads keyboard and updates program variable with key presses
 
 ########## USER SETTINGS ##############################
 vid='fiveSecondPlankton.mp4'    
 
 detectFileName='detection.csv'      # output file containing object location, area, aspect ratio for each video frame
+detectNpyName='detection.npy'       # same detections as a binary file, keeps AR and ANGLE fractions, see detections.py
+ONLINE_TRACKING=False               # True tracks objects while detecting (needs scipy), writes trackFileName and trackSummaryName
+trackFileName='track.csv'           # output file, detections with track ID instead of object number
+trackSummaryName='trackSummary.csv' # output file, first frame, last frame and detections of every track
 X_REZ=640; Y_REZ=480;               # viewing resolution
 MIN_AREA=10                         # min area of object detected
 MAX_AREA=1000                       # max area of object detected
@@ -33,7 +40,11 @@ PROCESS_REZ=(320,240)
 ############# DEFINE VARIABLES ##################
 detectHeader= 'FRAME,ID,X0,Y0,X1,Y1,XC,YC,AREA,AR,ANGLE'
 FRAME=0; ID=1;  X0=2;   Y0=3;   X1=4;   Y1=5;   XC=6;   YC=7; AREA=8; AR=9; ANGLE=10; MAX_COL=11 # pointers to detection features
-detectArray=np.empty((0,MAX_COL), dtype='int')  # detection features populated with object for each frame
+detectTable=detections.DetectionTable(detectFileName,npyName=detectNpyName) # detection features of each object, saved to detectFileName as the table fills
+if ONLINE_TRACKING:
+    import track        # tracks objects from frame to frame
+    tracker=track.Tracker(summaryFileName=trackSummaryName)    # only keeps active tracks, ended tracks are written to the summary file
+    trackTable=detections.DetectionTable(trackFileName)         # tracked objects, saved to trackFileName as the table fills
 
 ################### MAIN ###################
 print('''
@@ -80,7 +91,8 @@ while(cap.isOpened() and k.run):    # process each frame until end of video or '
     dummy,contourList, hierarchy = cv2.findContours(binaryIM, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE) # all countour points, uses more memory
     
     # draw bounding boxes around objects
-    objCount=0                                      # used as object ID in detectArray
+    objCount=0                                      # used as object ID in detectTable
+    frameRows=[]                                    # objects of this frame, for tracking
     for objContour in contourList:                  # process all objects in the contourList
         area = int(cv2.contourArea(objContour))     # find obj area        
         if area>MIN_AREA:                           # only detect large objects       
@@ -89,12 +101,20 @@ while(cap.isOpened() and k.run):    # process each frame until end of video or '
             cv2.rectangle(colorIM, (x0,y0), (x1,y1), (0,255,0), THICK) # place GREEN rectangle around each object, BGR
             (xc,yc,ar,angle)=getAR(objContour)
 
-            # save object parameters in detectArray in format FRAME=0; ID=1;  X0=2;   Y0=3;   X1=4;   Y1=5;   XC=6;   YC=7; CLASS=8; AREA=9; AR=10; ANGLE=11; MAX_COL=12
-            parm=np.array([[frameCount,objCount,x0,y0,x1,y1,xc,yc,area,ar,angle]],dtype='int') # create parameter vector (1 x MAX_COL) 
-            detectArray=np.append(detectArray,parm,axis=0)  # add parameter vector to bottom of detectArray, axis=0 means add row
+            # save object parameters in detectTable in format FRAME=0; ID=1;  X0=2;   Y0=3;   X1=4;   Y1=5;   XC=6;   YC=7; CLASS=8; AREA=9; AR=10; ANGLE=11; MAX_COL=12
+            detectTable.add([frameCount,objCount,x0,y0,x1,y1,xc,yc,area,ar,angle])  # add parameter vector to bottom of detectTable
+            frameRows.append([frameCount,objCount,x0,y0,x1,y1,xc,yc,area,ar,angle])
             objCount+=1                                     # indicate processed an object
     #print('frame:',frameCount,'objects:',len(contourList),'big objects:',objCount)
 
+    # track objects of this frame, ID becomes the track ID
+    if ONLINE_TRACKING:
+        frameData=np.array(frameRows,dtype=float).reshape(-1,MAX_COL)
+        tracker.update(frameCount,frameData)
+        trackTable.addRows(frameData)
+        for row in frameData:
+            cv2.putText(colorIM,str(int(row[ID])),(int(row[X0]),int(row[Y0])-2),cv2.FONT_HERSHEY_SIMPLEX,0.3,(0,0,255),1) # RED track ID above box
+
     # shows results
     cv2.imshow('colorIM', cv2.resize(colorIM,VGA))      # display image
     cv2.imshow('blurIM', cv2.resize(blurIM,VGA))# display thresh image
@@ -103,7 +123,10 @@ while(cap.isOpened() and k.run):    # process each frame until end of video or '
 # program ending, test why
 if frameCount>0:            # normal ending, save detection file
     print('Done with video. Saving feature file and exiting program')
-    np.savetxt(detectFileName,detectArray,header=detectHeader,delimiter=',', fmt='%d')
+    detectTable.close()   # save rows not written yet
+    if ONLINE_TRACKING:
+        trackTable.close()
+        tracker.close()   # tracks still active go to the summary file
     cap.release()
 else:                       # abnormal ending, don't save detection file
     print('Count not open video',vid)
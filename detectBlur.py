@@ -2,6 +2,7 @@
 # Uses blur to try and prevent one object from having multiple bounding boxes
 # Press 'q' to quit
 
+# V3 10.18.26 detections saved with detections.DetectionTable, written to the file as it fills instead of growing detectArray with np.append
 # V2 use full image
 # 10/15/2021 Tom Zimmerman CCC, IBM Research  
 # This work is funded by the National Science Foundation (NSF) grant No. DBI-1548297, Center for Cellular Construction.
@@ -10,10 +11,12 @@
 ############################## FOR EDUCATIONAL USE ONLY ####################
 import numpy as np
 import cv2
+import detections       # detection table, written to the detection file as it fills
 
 ########## USER SETTINGS ##############################
 vid=r'fiveSecondPlankton.mp4'    
 detectFileName='test.csv'
+detectNpyName='test.npy'     # same detections as a binary file, keeps AR and ANGLE fractions, see detections.py
 X_REZ=640; Y_REZ=480; # viewing resolution
 MIN_AREA=400    # min area of object detected
 THICK=2         # bounding box line thickness
@@ -23,7 +26,7 @@ BLUR=7          # must be odd number, larger means more blur
 ############# DETECT OUTPUT ##################
 detectHeader= 'FRAME,ID,X0,Y0,X1,Y1,XC,YC,AREA,AR,ANGLE'
 FRAME=0; ID=1;  X0=2;   Y0=3;   X1=4;   Y1=5;   XC=6;   YC=7; AREA=8; AR=9; ANGLE=10; MAX_COL=11
-detectArray=np.empty((0,MAX_COL), dtype='int') # cast as int since most features are int and it simplifies usage
+detectTable=detections.DetectionTable(detectFileName,npyName=detectNpyName) # detection features of each object, saved to detectFileName as the table fills
 
 def getAR(obj):
     ((xc,yc),(w,h),(angle)) = cv2.minAreaRect(obj)  # get parameters from min area rectangle
@@ -63,7 +66,7 @@ while(cap.isOpened()):
     dummy,contourList, hierarchy = cv2.findContours(threshIM, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE) # all countour points, uses more memory
     
     # draw bounding boxes around objects
-    objCount=0      # used as object ID in detectArray
+    objCount=0      # used as object ID in detectTable
     for objContour in contourList:                  # process all objects in the contourList
         area = int(cv2.contourArea(objContour))     # find obj area        
         if area>MIN_AREA:                           # only detect large objects       
@@ -72,9 +75,8 @@ while(cap.isOpened()):
             cv2.rectangle(colorIM, (x0,y0), (x1,y1), (0,255,0), THICK) # place GREEN rectangle around each object, BGR
             (xc,yc,ar,angle)=getAR(objContour)
 
-            # save object parameters in detectArray in format FRAME=0; ID=1;  X0=2;   Y0=3;   X1=4;   Y1=5;   XC=6;   YC=7; CLASS=8; AREA=9; AR=10; ANGLE=11; MAX_COL=12
-            parm=np.array([[frameCount,objCount,x0,y0,x1,y1,xc,yc,area,ar,angle]],dtype='int') # create parameter vector (1 x MAX_COL) 
-            detectArray=np.append(detectArray,parm,axis=0)  # add parameter vector to bottom of detectArray, axis=0 means add row
+            # save object parameters in detectTable in format FRAME=0; ID=1;  X0=2;   Y0=3;   X1=4;   Y1=5;   XC=6;   YC=7; CLASS=8; AREA=9; AR=10; ANGLE=11; MAX_COL=12
+            detectTable.add([frameCount,objCount,x0,y0,x1,y1,xc,yc,area,ar,angle])  # add parameter vector to bottom of detectTable
             objCount+=1                                     # indicate processed an object
     print('frame:',frameCount,'objects:',len(contourList),'big objects:',objCount)
 
@@ -87,7 +89,7 @@ while(cap.isOpened()):
 
 if frameCount>0:
     print('Done with video. Saving feature file and exiting program')
-    np.savetxt(detectFileName,detectArray,header=detectHeader,delimiter=',', fmt='%d')
+    detectTable.close()   # save rows not written yet
     cap.release()
 else:
     print('Count not open video',vid)
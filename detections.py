@@ -0,0 +1,307 @@
+'''
+Detection table for detect.py, DetectMedianThresh.py and detectBlur.py
+
+Growing detectArray with np.append() copies the whole table for every object, so a long video gets slower and slower.
+DetectionTable keeps rows in a preallocated buffer that doubles when full, so adding a row costs the same at the
+start and the end of a video. With a file name, full buffers are written to the CSV file instead of growing,
+so memory stays bounded for multi-hour videos.
+
+Rows have the usual detection columns FRAME,ID,X0,Y0,X1,Y1,XC,YC,AREA,AR,ANGLE and are kept as floats.
+The CSV file is the same as np.savetxt(detectFileName,detectArray,header=detectHeader,delimiter=',',fmt='%d'),
+so programs that read detection.csv with np.loadtxt(...,skiprows=1) don't change.
+
+The CSV file truncates AR and ANGLE to integers and np.loadtxt takes minutes on millions of rows, so the table can
+also be saved as a binary .npy file (npyName=). It keeps the float values, is appended to as the table fills
+(the header has a fixed size and is rewritten with the new row count) and loadDetections() memory maps it,
+so opening even a huge file is instant and only the rows used are read from disk.
+Rows are in frame order, a small index file (detection_index.npz) holds the first row of every frame,
+see loadFrameIndex(). When pyarrow (pip install pyarrow) is installed a Parquet copy (detection.parquet) is saved
+next to the .npy file, for pandas and other tools. Without pyarrow it is skipped.
+
+DetectionStore gives the rows of any frame without searching the whole table with np.where(data[:,FRAME]==k).
+Rows are sorted by frame once and the first row of every frame is kept (offsets), so a frame lookup is
+one array index and going through a whole video frame by frame is one pass over the table.
+
+Usage
+table=DetectionTable('detection.csv')      # rows are written to the file as the buffer fills
+table.add([frameCount,objCount,x0,y0,x1,y1,xc,yc,area,ar,angle])
+table.close()                               # write the rows left in the buffer
+
+table=DetectionTable()                      # everything kept in memory
+detectArray=table.array()
+
+table=DetectionTable('detection.csv',npyName='detection.npy')  # CSV and binary file
+data=loadDetections('detection.npy')       # same columns as np.loadtxt('detection.csv',delimiter=',',skiprows=1)
+frames,offsets=loadFrameIndex('detection.npy')   # rows of frames[i] are data[offsets[i]:offsets[i+1]]
+
+store=DetectionStore('detection.npy')      # or a .csv file name, or an array, changes to store.data never change the file
+rows=store.rows(23)                         # row numbers of frame 23 in store.data, like np.where(data[:,FRAME]==23)[0]
+for frame,frameData in store.iterFrames():  # every frame with detections, frameData is a view of store.data
+    print(frame,len(frameData))
+
+Convert an existing CSV file to detection.npy and detection_index.npz (and detection.parquet if pyarrow is installed)
+python detections.py detection.csv
+
+V1 10.18.26
+V2 10.18.26 binary .npy detection file with frame index, memory mapped loading, Parquet and CSV converter
+V3 10.18.26 DetectionStore, rows of a frame found with an offsets index instead of searching the table
+V4 10.18.26 Parquet copy saved with the .npy file when pyarrow is installed, frame index made again if older than the detection file
+V5 10.18.26 DetectionStore maps a .npy file copy on write, rows can be changed (e.g. track IDs) without changing the file
+Tom Zimmerman CCC, IBM Research
+This work is funded by the National Science Foundation (NSF) grant No. DBI-1548297, Center for Cellular Construction.
+Disclaimer:  Any opinions, findings and conclusions or recommendations expressed in this material are those of the authors and do not necessarily reflect the views of the National Science Foundation.
+'''
+import os
+import struct
+import sys
+import numpy as np
+
+DETECT_HEADER='FRAME,ID,X0,Y0,X1,Y1,XC,YC,AREA,AR,ANGLE'
+FRAME=0; ID=1;  X0=2;   Y0=3;   X1=4;   Y1=5;   XC=6;   YC=7; AREA=8; AR=9; ANGLE=10; MAX_COL=11 # pointers to detection features
+CHUNK_ROWS=4096     # rows in the buffer, with a file name this many rows are written at a time
+CSV_FORMAT='%d'     # same as the detect programs always wrote, use '%g' to keep AR and ANGLE fractions
+NPY_HEADER_BYTES=128        # fixed .npy header size, so the row count can be rewritten in place when rows are appended
+INDEX_SUFFIX='_index.npz'   # detection.npy -> detection_index.npz
+
+################# BINARY FILES #################
+def npyHeader(rows):
+    # .npy version 1.0 header for a (rows,MAX_COL) float64 array, always NPY_HEADER_BYTES long
+    header="{'descr': '<f8', 'fortran_order': False, 'shape': (%d, %d), }"%(rows,MAX_COL)
+    header=header.ljust(NPY_HEADER_BYTES-10-1)+'\n'  # 10 bytes magic, version and length, ends with newline
+    return(b'\x93NUMPY\x01\x00'+struct.pack('<H',len(header))+header.encode('latin1'))
+
+def appendNpy(npyName,rows):
+    # append rows to a detection .npy file (made if missing), returns rows in the file
+    rows=np.ascontiguousarray(rows,dtype='<f8').reshape(-1,MAX_COL)
+    if not os.path.isfile(npyName):
+        with open(npyName,'wb') as f:
+            f.write(npyHeader(0))
+    with open(npyName,'r+b') as f:
+        start=f.read(10)
+        if start[:8]!=b'\x93NUMPY\x01\x00' or struct.unpack('<H',start[8:10])[0]!=NPY_HEADER_BYTES-10:
+            raise ValueError(npyName+' was not written by appendNpy, can not append to it')
+        size=f.seek(0,2)
+        total=(size-NPY_HEADER_BYTES)//(8*MAX_COL)     # rows already in the file, a half written row is overwritten
+        f.seek(NPY_HEADER_BYTES+total*8*MAX_COL)
+        f.write(rows.tobytes())
+        f.truncate()
+        total+=len(rows)
+        f.seek(0)
+        f.write(npyHeader(total))   # rows are written before the count, so the file is never longer than its header says
+    return(total)
+
+def getIndexName(fileName):
+    return(os.path.splitext(fileName)[0]+INDEX_SUFFIX)
+
+def makeFrameIndex(frameColumn):
+    # (frames,offsets) of rows in frame order, rows of frames[i] are offsets[i] to offsets[i+1]-1
+    frameColumn=np.asarray(frameColumn)
+    if len(frameColumn)>1 and np.any(frameColumn[1:]<frameColumn[:-1]):
+        raise ValueError('detection rows are not in frame order')
+    starts=np.flatnonzero(np.diff(frameColumn))+1
+    offsets=np.concatenate(([0],starts,[len(frameColumn)])).astype(np.int64)
+    frames=frameColumn[offsets[:-1]].astype(np.int64) if len(frameColumn)>0 else np.zeros(0,dtype=np.int64)
+    return(frames,offsets)
+
+def saveFrameIndex(fileName,data):
+    frames,offsets=makeFrameIndex(data[:,FRAME])
+    np.savez(getIndexName(fileName),frames=frames,offsets=offsets)
+    return(frames,offsets)
+
+def loadFrameIndex(fileName,data=None):
+    # (frames,offsets) from the index file, made again if it is missing or older than the detection file
+    if data is None:
+        data=loadDetections(fileName)
+    indexName=getIndexName(fileName)
+    if os.path.isfile(indexName):
+        with np.load(indexName) as index:
+            frames=index['frames']; offsets=index['offsets']
+        if offsets[-1]==len(data) and os.path.getmtime(indexName)>=os.path.getmtime(fileName):
+            return(frames,offsets)
+    return(saveFrameIndex(fileName,data))
+
+def loadDetections(fileName,mmapMode='r'):
+    # detection rows of a .npy (memory mapped, read only), .parquet or .csv file as a (rows,MAX_COL) array
+    # mmapMode='c' maps a .npy file copy on write, rows can be changed in memory and the file stays the same
+    ext=os.path.splitext(fileName)[1].lower()
+    if ext=='.npy':
+        return(np.load(fileName,mmap_mode=mmapMode))
+    if ext=='.parquet':
+        import pyarrow.parquet as pq
+        table=pq.read_table(fileName)
+        return(np.stack([table.column(name).to_numpy() for name in DETECT_HEADER.split(',')],axis=1).astype(float))
+    return(np.loadtxt(fileName,delimiter=',',skiprows=1,ndmin=2))
+
+def getParquetName(fileName):
+    return(os.path.splitext(fileName)[0]+'.parquet')
+
+def saveParquet(fileName,data):
+    # one column per detection feature, returns the file name or None if pyarrow (pip install pyarrow) is not installed
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        return(None)
+    columns={name:np.ascontiguousarray(data[:,i]) for i,name in enumerate(DETECT_HEADER.split(','))}
+    pq.write_table(pa.table(columns),fileName)
+    return(fileName)
+
+def csvToNpy(csvName,npyName=None):
+    # convert a detection CSV file to a .npy file and frame index, returns the .npy file name
+    if npyName is None:
+        npyName=os.path.splitext(csvName)[0]+'.npy'
+    data=np.loadtxt(csvName,delimiter=',',skiprows=1,ndmin=2)
+    data=data[np.argsort(data[:,FRAME],kind='stable')]  # index needs frame order
+    if os.path.isfile(npyName):
+        os.remove(npyName)
+    appendNpy(npyName,data)
+    saveParquet(getParquetName(npyName),data)
+    saveFrameIndex(npyName,data)    # last, the index must not be older than the detection files
+    return(npyName)
+
+################# DETECTION STORE #################
+class DetectionStore:
+    def __init__(self,data):
+        # data is a detection file name (.npy, .parquet, .csv) or a (rows,MAX_COL) array
+        fileName=None
+        if isinstance(data,str):
+            fileName=data
+            data=loadDetections(fileName,mmapMode='c')  # copy on write, so callers like track.py can set the ID column
+        if not isinstance(data,np.memmap):
+            data=np.asarray(data).reshape(-1,MAX_COL)
+        frameColumn=data[:,FRAME]
+        if len(frameColumn)>1 and np.any(frameColumn[1:]<frameColumn[:-1]):
+            data=data[np.argsort(frameColumn,kind='stable')]   # sort once, rows of a frame keep their order
+            fileName=None       # saved index is for the unsorted file
+        self.data=data
+        if fileName is not None and fileName.lower().endswith('.npy'):
+            self.frames,self.offsets=loadFrameIndex(fileName,data)
+        else:
+            self.frames,self.offsets=makeFrameIndex(data[:,FRAME])
+        # first row of every frame number from firstFrame to lastFrame+1, frames without detections have no rows
+        self.firstFrame=int(self.frames[0]) if len(self.frames)>0 else 0
+        lastFrame=int(self.frames[-1]) if len(self.frames)>0 else -1
+        self.starts=self.offsets[np.searchsorted(self.frames,np.arange(self.firstFrame,lastFrame+2))]
+        self.frameCount=len(self.frames)    # frames with detections
+
+    def __len__(self):
+        return(len(self.data))
+
+    def span(self,frame):
+        # (first row, last row+1) of frame
+        i=int(frame)-self.firstFrame
+        if i<0 or i>=len(self.starts)-1:
+            return(0,0)
+        return(int(self.starts[i]),int(self.starts[i+1]))
+
+    def rows(self,frame):
+        # row numbers of frame in self.data
+        (start,end)=self.span(frame)
+        return(np.arange(start,end))
+
+    def frame(self,frame):
+        # detections of frame, a view so changes (e.g. ID) are made in self.data
+        (start,end)=self.span(frame)
+        return(self.data[start:end])
+
+    def iterFrames(self):
+        # (frame number, detections) of every frame with detections, in frame order
+        for i in range(len(self.frames)):
+            yield(int(self.frames[i]),self.data[self.offsets[i]:self.offsets[i+1]])
+
+################# DETECTION TABLE #################
+class DetectionTable:
+    def __init__(self,fileName=None,chunkRows=CHUNK_ROWS,fmt=CSV_FORMAT,npyName=None):
+        self.fileName=fileName
+        self.npyName=npyName    # binary file, written along with the CSV file
+        self.npyStarted=False   # an old binary file is replaced when the first rows are written
+        self.fmt=fmt
+        self.buffer=np.empty((chunkRows,MAX_COL))
+        self.count=0            # rows in the buffer
+        self.rows=0             # rows added since the start
+        self.file=None          # opened when the first rows are written, so nothing is made if the video can't be read
+
+    def __len__(self):
+        return(self.rows)
+
+    def add(self,row):
+        # add one detection, row is [frame,id,x0,y0,x1,y1,xc,yc,area,ar,angle]
+        if self.count==len(self.buffer):
+            self.makeRoom()
+        self.buffer[self.count]=row
+        self.count+=1
+        self.rows+=1
+        return
+
+    def addRows(self,rows):
+        # add many detections at once, rows is (n,MAX_COL)
+        rows=np.asarray(rows,dtype=float).reshape(-1,MAX_COL)
+        while len(rows)>0:
+            if self.count==len(self.buffer):
+                self.makeRoom()
+            n=min(len(rows),len(self.buffer)-self.count)
+            self.buffer[self.count:self.count+n]=rows[:n]
+            self.count+=n
+            self.rows+=n
+            rows=rows[n:]
+        return
+
+    def makeRoom(self):
+        # buffer is full, write it to the file or double its size
+        if self.fileName is not None or self.npyName is not None:
+            self.flush()
+        else:
+            bigger=np.empty((2*len(self.buffer),MAX_COL))
+            bigger[:self.count]=self.buffer[:self.count]
+            self.buffer=bigger
+        return
+
+    def openFile(self):
+        if self.file is None:
+            self.file=open(self.fileName,'w')
+            self.file.write('# '+DETECT_HEADER+'\n')   # same header line as np.savetxt
+        return
+
+    def flush(self):
+        # write the rows in the buffer to the files
+        if self.fileName is not None:
+            self.openFile()
+        if self.npyName is not None and not self.npyStarted:
+            if os.path.isfile(self.npyName):
+                os.remove(self.npyName)
+            appendNpy(self.npyName,[])
+            self.npyStarted=True
+        if self.count>0 and (self.file is not None or self.npyName is not None):
+            if self.file is not None:
+                np.savetxt(self.file,self.buffer[:self.count],delimiter=',',fmt=self.fmt)
+                self.file.flush()
+            if self.npyName is not None:
+                appendNpy(self.npyName,self.buffer[:self.count])
+            self.count=0
+        return
+
+    def array(self):
+        # rows still in memory (all rows when there is no file), shares memory with the buffer
+        return(self.buffer[:self.count])
+
+    def save(self,fileName):
+        # save rows in memory as a detection CSV file
+        np.savetxt(fileName,self.array(),header=DETECT_HEADER,delimiter=',',fmt=self.fmt)
+        return
+
+    def close(self):
+        self.flush()
+        if self.file is not None:
+            self.file.close()
+            self.file=None
+        if self.npyName is not None:
+            data=loadDetections(self.npyName)
+            saveParquet(getParquetName(self.npyName),data)
+            saveFrameIndex(self.npyName,data)   # last, the index must not be older than the detection files
+        return
+
+################################ MAIN ##################################
+if __name__=='__main__':   # convert detection CSV files given on the command line
+    for csvName in sys.argv[1:]:
+        npyName=csvToNpy(csvName)
+        print('Converted',csvName,'to',npyName,len(loadDetections(npyName)),'rows')
@@ -0,0 +1,88 @@
+"""
+findZ_batch
+Automatically find reconstruction Z for every image in a directory and save the reconstructed image with z in the file name
+Non-interactive version of findZ.py, images are autofocused (see autofocus.py) several at a time, one per process.
+Designed for file format 'alg_3_4360_raw.jpg', saves 'alg_3_4500_reco.jpg' where 4500 is the z found (microns)
+
+A manifest (CSV) lists file, best z, focus score and seconds for every image.
+Images already in the manifest with a z are skipped, so a stopped run continues where it left off.
+Images that can't be read or have an unexpected file name get a line without z and are tried again on the next run.
+
+V1 10.18.26
+V2 10.18.26 an image that fails doesn't stop the run, failed images are retried on the next run
+
+Tom Zimmerman CCC, IBM Research
+This work is funded by the National Science Foundation (NSF) grant No. DBI-1548297, Center for Cellular Construction.
+Disclaimer:  Any opinions, findings and conclusions or recommendations expressed in this material are those of the authors and do not necessarily reflect the views of the National Science Foundation.
+"""
+import os
+import time
+import cv2
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import reco         # performs reconstruction
+import autofocus    # finds best reconstruction z
+
+################## SETTINGS ################
+dirIn = 'rawImage'
+dirOut = 'recoImage'
+manifestName = 'findZ_manifest.csv'   # saved in dirOut
+zScale=1e-6         # convert z units to microns
+zStep = 20          # z found is rounded to this step (microns)
+Z_RANGE=(200,7000)  # z range searched (microns)
+METRIC='line'       # focus metric, see autofocus.py
+WORKERS=os.cpu_count()  # images processed at the same time
+
+################# FUNCTIONS #################
+def readManifest(manifestPath):
+    # names of files already done, lines without a z failed and are not done
+    done=set()
+    if os.path.isfile(manifestPath):
+        with open(manifestPath) as f:
+            for line in f.readlines()[1:]:
+                a=line.strip().split(',')
+                if len(a)>1 and a[1]!='':
+                    done.add(a[0])
+    return(done)
+
+def focusFile(fileName):
+    # autofocus one image, save reconstruction, returns manifest line, without z if the image failed
+    startTime=time.time()
+    try:
+        a=fileName.split('_')    # file format 'alg_3_4360_raw.jpg'
+        if len(a)<4:
+            raise ValueError('file name is not like alg_3_4360_raw.jpg')
+        im = cv2.imread(os.path.join(dirIn,fileName), 0) #Read the image as grayscale
+        if im is None:
+            raise ValueError('can not read image')
+        bestZ,score=autofocus.findBestZ(im,Z_RANGE[0]*zScale,Z_RANGE[1]*zScale,METRIC)
+        z=int(round(bestZ/zScale/zStep))*zStep
+        newName=a[0]+'_'+a[1]+'_'+str(z)+'_reco.jpg'
+        cv2.imwrite(os.path.join(dirOut,newName),reco.recoFrame(im,z*zScale))
+    except Exception as e:
+        print('Skipped',fileName,e)
+        return(fileName+',,,'+str(round(time.time()-startTime,3)))
+    return(fileName+','+str(z)+','+str(score)+','+str(round(time.time()-startTime,3)))
+
+##############  MAIN  ##############
+if __name__=='__main__':   # needed so processes started by the pool don't rerun the main program
+    os.makedirs(dirOut,exist_ok=True)
+    manifestPath=os.path.join(dirOut,manifestName)
+    done=readManifest(manifestPath)
+    files = [f for f in os.listdir(dirIn) if os.path.isfile(os.path.join(dirIn, f)) if not f.startswith('.')] # skip Mac hidden files
+    files = [f for f in files if f not in done]
+    print(len(done),'images already done,',len(files),'to process')
+
+    if not os.path.isfile(manifestPath):
+        with open(manifestPath,'w') as f:
+            f.write('FILE,Z,SCORE,SECONDS\n')
+    startTime=time.time()
+    with ProcessPoolExecutor(max_workers=WORKERS) as pool, open(manifestPath,'a') as manifest:
+        jobs=[pool.submit(focusFile,fileName) for fileName in files]
+        for count,job in enumerate(as_completed(jobs)):
+            line=job.result()
+            manifest.write(line+'\n')
+            manifest.flush()        # keep the manifest up to date in case the run is stopped
+            print(count+1,'/',len(files),line)
+    seconds=time.time()-startTime
+    if len(files)>0:
+        print('Done,',len(files),'images in',round(seconds,1),'seconds,',round(len(files)/seconds,2),'images/s')
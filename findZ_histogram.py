@@ -3,6 +3,7 @@ findZ
 Manually find reconsturction Z and save reconstructed image and z value in image name
 Designed for file format 'alg_3_4360.jpg'. Change line 96 if different format.
 
+V11 10.18.26 Use reco module for reconstruction, forward FFT done once per image and only reconstruct when z changes
 V10 9.13.21 Added startswith for Mac hidden files
 V9  8.21.21 Prevent Z from going negative, added instructions
 v8  8.21.21 Fixed rollover error on reconstruction using clipping
@@ -19,6 +20,7 @@ Disclaimer:  Any opinions, findings and conclusions or recommendations expressed
 """
 import numpy as np
 import cv2
+import reco         # performs reconstruction
 from os import listdir,rename,getcwd
 from os.path import isfile, join
 from matplotlib import pyplot as plt
@@ -26,8 +28,6 @@ from matplotlib import pyplot as plt
 ################## SETTINGS ################
 defaultZ=3000       # if z is not known
 zStep = 20          # how many Z values to traverse at a time.
-dxy   = 1.4e-6      # imager pixel size in meters.
-wvlen = 650.0e-9    # red laser wavelength (meters)
 zScale=1e-6         # convert z units to microns 
 DISPLAY_REZ=(800,800)  
 
@@ -36,42 +36,6 @@ dirOut = r'\recoImage\\'
 imageNamePrefix='testImage'        # used when saving images
 ################# FUNCTIONS #################
 
-def recoFrame(cropIM, z):
-    #make even coordinates
-    (yRez,xRez)=cropIM.shape
-    if (xRez%2)==1:
-        xRez-=1
-    if (yRez%2)==1:
-        yRez-=1
-    cropIM=cropIM[0:yRez,0:xRez]
-    res = propagate(np.sqrt(cropIM), wvlen, z, dxy)	 #calculate wavefront at z
-    amp = np.abs(res)**2          # output is the complex field, still need to compute intensity via abs(res)**2
-    amp = np.clip(amp,0,255)        # prevent rollover when converting to 8 bit
-    ampInt = amp.astype('uint8')
-    return(ampInt)
-
-def propagate(input_img, wvlen, zdist, dxy):
-    M, N = input_img.shape # get image size, rows M, columns N, they must be even numbers!
-
-    # prepare grid in frequency space with origin at 0,0
-    _x1 = np.arange(0,N/2)
-    _x2 = np.arange(N/2,0,-1)
-    _y1 = np.arange(0,M/2)
-    _y2 = np.arange(M/2,0,-1)
-    _x  = np.concatenate([_x1, _x2])
-    _y  = np.concatenate([_y1, _y2])
-    x, y  = np.meshgrid(_x, _y)
-    kx,ky = x / (dxy * N), y / (dxy * M)
-    kxy2  = (kx * kx) + (ky * ky)
-
-    # compute FT at z=0
-    E0 = np.fft.fft2(np.fft.fftshift(input_img))
-
-    # compute phase aberration
-    _ph_abbr   = np.exp(-1j * np.pi * wvlen * zdist * kxy2)
-    output_img = np.fft.ifftshift(np.fft.ifft2(E0 * _ph_abbr))
-    return output_img
-
 def directions():
     print('='*30,'DIRECTIONS','='*30)
     print('Click on image to enable key commands')
@@ -121,8 +85,12 @@ for i in range(startIndex,len(files)):
     done=False
     end=False
     reject=False
+    E0 = reco.recoE0(im)    # forward FFT only depends on the image, so do it once per file
+    recoZ=-1                # z of the current ampIM
     while done==False and end==False:
-        ampIM = recoFrame(im, z*zScale)
+        if z!=recoZ:        # only reconstruct when z changes
+            ampIM = reco.recoFromE0(E0, z*zScale, reco.recoShape(im))
+            recoZ=z
         cv2.imshow('reco',cv2.resize(ampIM,DISPLAY_REZ))
         cv2.imshow('raw',cv2.resize(im,DISPLAY_REZ))
         if z!=lastZ:
@@ -1,66 +1,56 @@
 # Run a stack of images through a 0 and 90 deg Gabor Filter
 # Select the image with the highest Gabor value
 # Tom Zimmerman, IBM Research-Almaden, CCC, 5.1.23
+# V3 10.18.26 Set holoFileName to score reconstructions of one raw hologram over a Z range, no reco images are saved
+# V2 10.18.26 Whole stack is scored at once with autofocus.gaborStack (FFT filtering on all cores), filters in floating point
 
 import numpy as np
-from scipy import ndimage as ndi
-from skimage.filters import gabor_kernel
 from os.path import isfile, join
 from os import listdir
 import cv2
 from matplotlib import pyplot as plt
-import math
+import autofocus    # Gabor focus metric
+import reco         # performs reconstruction
 
 
 rawImageDir=r'C5_Z5\\'     
 savePlotFileName=r'C5.png'
-
-def convolve(image, kernel):
-    feat = np.zeros((len(kernel)), dtype=np.double)
-    filtered = ndi.convolve(image, kernel, mode='wrap')
-    feat = filtered.var()
-    return feat
+PROCESS_REZ=(640,480)   # make images smaller for faster processing
+holoFileName=None       # raw hologram, e.g. r'rawImage\blep_1_820_raw.jpg', None scores the image stack in rawImageDir
+Z_RANGE=(200,7000,20)   # first, last and step z of the hologram reconstructions (microns)
+Z_SCALE=1e-6            # convert z units to microns
 
 ################## MAIN ##########################
 
-# prepare filter kernels
-theta=0
-angle = theta / 4. * np.pi
-sigma=1 # 4,9,12
-frequency=0.35 #0.125, 0.25,0.35,0.50
-kernel0 = np.real(gabor_kernel(frequency, theta=angle,sigma_x=sigma, sigma_y=sigma))
-theta=90
-angle = theta / 4. * np.pi
-kernel90 = np.real(gabor_kernel(frequency, theta=angle,sigma_x=sigma, sigma_y=sigma))
+if holoFileName is None:
+    # load Z stack, images are named 0.jpg, 1.jpg,...
+    files = [f for f in listdir(rawImageDir) if isfile(join(rawImageDir, f))]
+    stack=np.zeros((len(files),PROCESS_REZ[1],PROCESS_REZ[0]),dtype='uint8')
+    for i in range(len(files)):
+        fileName=rawImageDir+str(i)+'.jpg'
+        print(fileName)
+        grayIM=cv2.imread(fileName,0)        # load as grayscale
+        stack[i]=cv2.resize(grayIM, PROCESS_REZ)
+
+    # Gabor filter value of every image, Gabor settings are in autofocus.py
+    gvar,bestFocus=autofocus.gaborStack(stack)
+    xValues=np.arange(len(gvar))
+    xLabel='image number'
+else:
+    # reconstruct the hologram at every z and score it, reconstructions are never saved
+    holoIM=cv2.imread(holoFileName,0)
+    zList=np.arange(Z_RANGE[0],Z_RANGE[1]+1,Z_RANGE[2])
+    gvar,best=autofocus.gaborZScan(holoIM,zList*Z_SCALE)
+    bestFocus=zList[best]
+    xValues=zList
+    xLabel='z (microns)'
 
-# process Z stack
-files = [f for f in listdir(rawImageDir) if isfile(join(rawImageDir, f))]
-gvar=np.zeros((len(files),2))
-maxGabor=0
-bestFocus=0
-for i in range(len(files)):
-    fileName=rawImageDir+str(i)+'.jpg'
-    print(fileName)
-    grayIM=cv2.imread(fileName,0)        # load as grayscale
-    tinyIM=cv2.resize(grayIM, (640,480))    # make image smaller for faster processing
-    
-    gaborValue0=convolve(tinyIM, kernel0)
-    gaborValue90=convolve(tinyIM, kernel90)
-    gaborValue=math.sqrt(gaborValue0**2+gaborValue90**2)
-    gvar[i]=gaborValue
-    if gaborValue>maxGabor:
-        maxGabor=gaborValue
-        bestFocus=i
-    
 # plot and save Gabor plot
-plt.plot(gvar)
-plt.xlabel('image number')
+plt.plot(xValues,gvar)
+plt.xlabel(xLabel)
 plt.ylabel('gabor filter value')
 plt.title("Gabor Filter on Images  Best="+str(bestFocus))
 plt.savefig(savePlotFileName)
 plt.show()
 
-print('bestFocusImage',bestFocus)
-
-
-
+print('bestFocus',bestFocus)
@@ -0,0 +1,181 @@
+'''
+Random access video frame reader for interactive programs like holoVideoReco.py
+
+cap.set(cv2.CAP_PROP_POS_FRAMES,index) before every read makes the decoder jump back to the nearest keyframe
+and decode forward, so stepping one frame can cost tens of decoded frames. FrameReader avoids that:
+    it remembers where the decoder is and reads forward without seeking for small forward steps
+    it keeps the most recently decoded grayscale frames in a cache, so stepping back is free
+    when PyAV (pip install av) is installed it finds the keyframes when the video is opened, so it knows
+    when reading forward is cheaper than seeking, and fills the cache from the keyframe on a backward jump
+
+LiveCapture reads a live camera in its own thread and keeps only the newest frame. Reconstruction is slower than
+the camera, so reading the camera in the display loop lets stale frames pile up in the driver buffer and the image
+lags behind the microscope. With LiveCapture the display always gets the newest frame, older frames not read in
+time are dropped and counted.
+
+Usage
+reader=FrameReader('M6.mp4')
+ret,grayIM=reader.read(23)
+
+cam=LiveCapture(0,1920,1080)
+ret,rawIM=cam.read()        # newest frame, BGR like cap.read()
+print(cam.captured,cam.dropped)
+
+V1 10.18.26
+V2 10.18.26 added LiveCapture, capture thread with newest-frame buffer for live cameras
+V3 10.18.26 LiveCapture waits up to FIRST_FRAME_WAIT for the first frame so slow starting cameras are not reported missing
+Thomas Zimmerman, IBM Research-Almaden
+This work is funded by the National Science Foundation (NSF) grant No. DBI-1548297, Center for Cellular Construction.
+Disclaimer:  Any opinions, findings and conclusions or recommendations expressed in this material are those of the authors and do not necessarily reflect the views of the National Science Foundation.
+'''
+
+import cv2
+import numpy as np
+import threading
+from collections import OrderedDict
+
+CACHE_SIZE=64       # decoded grayscale frames kept, a 1080p frame is 2 MB
+MAX_FORWARD=30      # without a keyframe index, read forward instead of seeking if the frame is at most this far ahead
+FRAME_WAIT=0.5      # seconds LiveCapture.read() waits for a new frame before returning the last one again
+FIRST_FRAME_WAIT=10 # seconds LiveCapture.read() waits for the first frame, cameras can take seconds to start streaming
+
+def getKeyFrames(vid):
+    # returns sorted array of keyframe numbers, or None if PyAV is not installed or the video can't be read
+    try:
+        import av
+    except ImportError:
+        return(None)
+    try:
+        with av.open(vid) as container:
+            stream=container.streams.video[0]
+            fps=stream.average_rate
+            start=stream.start_time or 0
+            keyFrames=[]
+            for packet in container.demux(stream):  # only reads packets, nothing is decoded
+                if packet.is_keyframe and packet.pts is not None:
+                    keyFrames.append(int(round(float((packet.pts-start)*stream.time_base*fps))))
+    except Exception as e:
+        print('Could not index keyframes of',vid,e)
+        return(None)
+    if len(keyFrames)==0:
+        return(None)
+    return(np.unique(keyFrames))
+
+class FrameReader:
+    def __init__(self,vid,cacheSize=CACHE_SIZE,maxForward=MAX_FORWARD):
+        self.cap=cv2.VideoCapture(vid)
+        self.cacheSize=cacheSize
+        self.maxForward=maxForward
+        self.cache=OrderedDict()    # frame number -> grayscale image, most recently used at the end
+        self.position=0             # frame number the next cap.read() returns
+        self.frameCount=int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.keyFrames=getKeyFrames(vid)
+
+    def isOpened(self):
+        return(self.cap.isOpened())
+
+    def release(self):
+        self.cap.release()
+        self.cache.clear()
+        return
+
+    def keyFrameBefore(self,index):
+        # last keyframe at or before index
+        i=np.searchsorted(self.keyFrames,index,side='right')-1
+        return(self.keyFrames[max(i,0)])
+
+    def readForward(self,index):
+        # read forward if the decoder has to pass through the keyframe anyway, else seeking is faster
+        if self.keyFrames is not None:
+            return(self.keyFrameBefore(index)<=self.position)
+        return(index-self.position<=self.maxForward)
+
+    def store(self,index,grayIM):
+        self.cache[index]=grayIM
+        self.cache.move_to_end(index)
+        while len(self.cache)>self.cacheSize:
+            self.cache.popitem(last=False)  # drop least recently used frame
+        return
+
+    def read(self,index):
+        # returns (ret,grayIM) for frame index, grayIM is shared with the cache so copy it before drawing on it
+        if index in self.cache:
+            self.cache.move_to_end(index)
+            return(True,self.cache[index])
+
+        if index<self.position or not self.readForward(index):
+            start=index
+            if self.keyFrames is not None:
+                start=self.keyFrameBefore(index)    # decoding starts at the keyframe anyway, keep those frames
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES,start)
+            self.position=start
+
+        # decode forward to index, frames close to index are kept for stepping back
+        while self.position<=index:
+            if index-self.position<self.cacheSize:
+                ret,rawIM=self.cap.read()
+                if ret:
+                    self.store(self.position,cv2.cvtColor(rawIM,cv2.COLOR_BGR2GRAY))
+            else:
+                ret=self.cap.grab()     # too far back to be cached, don't convert
+            if not ret:
+                self.position=float('inf')  # decoder position unknown, seek on the next read
+                return(False,None)
+            self.position+=1
+        return(True,self.cache[index])
+
+class LiveCapture:
+    def __init__(self,cam,xRez=None,yRez=None):
+        self.cap=cv2.VideoCapture(cam)
+        if xRez is not None:
+            self.cap.set(cv2.CAP_PROP_FRAME_WIDTH,xRez)
+            self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT,yRez)
+        self.cap.set(cv2.CAP_PROP_BUFFERSIZE,1)    # ask the driver not to queue old frames, not all cameras support it
+        self.newFrame=threading.Condition()
+        self.frame=None             # newest frame from the camera
+        self.frameNumber=-1         # number of the newest frame
+        self.lastRead=-1            # number of the last frame returned by read()
+        self.captured=0             # frames read from the camera
+        self.dropped=0              # frames replaced by a newer one before read() returned them
+        self.running=self.cap.isOpened()
+        self.thread=threading.Thread(target=self.capture,daemon=True)
+        if self.running:
+            self.thread.start()
+
+    def isOpened(self):
+        return(self.running)
+
+    def capture(self):
+        # capture thread, reads the camera as fast as it delivers frames
+        while self.running:
+            ret,rawIM=self.cap.read()
+            with self.newFrame:
+                if not ret:
+                    self.running=False  # camera unplugged or end of video
+                else:
+                    if self.frame is not None and self.frameNumber>self.lastRead:
+                        self.dropped+=1     # previous frame was never read
+                    self.frame=rawIM
+                    self.frameNumber+=1
+                    self.captured+=1
+                self.newFrame.notify_all()
+        return
+
+    def read(self,wait=True):
+        # returns (ret,rawIM) with the newest frame, wait=True waits for a frame newer than the last one read
+        with self.newFrame:
+            if self.frame is None:
+                self.newFrame.wait_for(lambda: self.frame is not None or not self.running,FIRST_FRAME_WAIT)
+            elif wait:
+                self.newFrame.wait_for(lambda: self.frameNumber>self.lastRead or not self.running,FRAME_WAIT)
+            if self.frame is None or (not self.running and self.frameNumber==self.lastRead):
+                return(False,None)     # camera stopped and the last frame was already read
+            self.lastRead=self.frameNumber
+            return(True,self.frame)
+
+    def release(self):
+        self.running=False
+        if self.thread.is_alive():
+            self.thread.join()
+        self.cap.release()
+        return
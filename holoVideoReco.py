@@ -5,6 +5,10 @@ Holgraphic Reconstruction Algorithms by Nick Antipac, UC Berkeley and  Daniel El
 This work is funded by the National Science Foundation (NSF) grant No. DBI-1548297, Center for Cellular Construction.
 Disclaimer:  Any opinions, findings and conclusions or recommendations expressed in this material are those of the authors and do not necessarily reflect the views of the National Science Foundation. 
 
+v10 10.18.26 Frames that can't be read are skipped by the display and prefetch, prefetch stops at the same last frame as the buttons
+v9 10.18.26 Button presses and clicks within DRAW_MS are drawn by one redraw, status label is made once and updated
+v8 10.18.26 Background prefetch decodes and reconstructs frames +-1 and +-10 at the current crop and Z while the user is idle
+v7 10.18.26 Uses frameReader so stepping frames reads forward from the current position and recent frames are cached, instead of seeking every frame
 v6 11.17.21 Replaced the working directly with using the explicit path in 'vid=' (line 47)
 V5 9.01.21 Changed call from vc3 to reco (renamed)
 V4 3.01.21 Removed unused buttons, added instructions, uses vc3 support function file
@@ -40,8 +44,11 @@ Use Frame to move around the frames in the movie
 
 import tkinter as tk
 import reco                 # performs reconstruction
+import frameReader          # reads video frames without seeking for every frame
 import cv2
 import numpy as np
+import threading
+from collections import OrderedDict
 
 
 vid=r'\rawVideo\M6.mp4'     # put your video location here, including the full path, must be mp4, use ffmpeg to convert microscope .h264 to .mp4
@@ -64,6 +71,16 @@ xc=1082; yc=468;        # initial center of crop window
 getCenter=False         # flag that when sets xc,y, to mouse location on click
 savePic=False           # save pic of reconstruction when flag set
 imageCount=0            # used when saving image
+PREFETCH_STEPS=[1,-1,10,-10]    # frames around the current frame reconstructed in the background while the user is idle
+PREFETCH_MB=200         # max memory used by prefetched reconstructions (megabytes)
+recoCache=OrderedDict() # (frame,window,Z) -> reconstructed image, most recently used at the end
+recoCacheBytes=0
+currentKey=None         # (frame,window,Z) on display, prefetch stops as soon as it changes
+readerLock=threading.Lock()     # reader and recoCache are shared with the prefetch thread
+prefetchWake=threading.Event()  # set when there is a new image to prefetch around
+DRAW_MS=33              # button presses within this time (milliseconds) are drawn by one redraw
+redrawPending=False     # a redraw is already scheduled
+statusLabel=None        # status line, made once and updated
 
 # Button names. Some are left blank for future functions.
 names = [
@@ -108,12 +125,31 @@ def doMouse(event,x,y,flags,param):
     
     if getCenter and event == cv2.EVENT_LBUTTONDOWN:
         xc,yc = x*FULL_SCALE,y*FULL_SCALE # compensate for full scale scaling
-        processImage()
+        requestRedraw()
     return
 
 def updateStatusDisplay():
+    global statusLabel
     textOut='   Frame='+ str(frameCount) + '    Crop=' + str(CROP) + '    Z=' + str(Z) + '    Display=' + str(displayScale)+'   '
-    tk.Label(root, text=textOut,bg="yellow",justify = tk.LEFT).grid(row=0,column=0,columnspan=4)
+    if statusLabel is None:
+        statusLabel=tk.Label(root, text=textOut,bg="yellow",justify = tk.LEFT)
+        statusLabel.grid(row=0,column=0,columnspan=4)
+    else:
+        statusLabel.config(text=textOut)
+    return
+
+def requestRedraw():
+    # schedule one redraw, more requests before it runs are drawn by the same redraw
+    global redrawPending
+    if not redrawPending:
+        redrawPending=True
+        root.after(DRAW_MS,redraw)
+    return
+
+def redraw():
+    global redrawPending
+    redrawPending=False
+    processImage()
     return
 
 def savePicture(holoIM,cropIM):
@@ -194,26 +230,80 @@ def doButton():
            CROP=1
     
     updateStatusDisplay()
-    processImage()
+    requestRedraw()
+    return
+
+
+def storeReco(key,recoIM):
+    global recoCacheBytes
+    with readerLock:
+        if key[1:]!=currentKey[1:]:     # crop or Z changed while reconstructing, throw it away
+            return
+        recoCache[key]=recoIM
+        recoCacheBytes+=recoIM.nbytes
+        while recoCacheBytes>PREFETCH_MB*1e6 and len(recoCache)>1:
+            oldKey,oldIM=recoCache.popitem(last=False)
+            recoCacheBytes-=oldIM.nbytes
     return
 
+def getFrameReco(key):
+    # returns grayscale frame and reconstructed crop for key=(frame,window,Z), from recoCache when prefetched
+    # returns (None,None) if the frame can't be read
+    (frame,win,z)=key
+    with readerLock:
+        ret, grayIM = reader.read(frame)    # grayscale frame, cached frames are not decoded again
+        recoIM=recoCache.get(key)
+    if not ret:
+        return(None,None)
+    if recoIM is None:
+        cropIM=grayIM[win[0]:win[1],win[2]:win[3]] # crop window of image
+        recoIM=reco.recoFrame(cropIM,z*Z_SCALE)
+        storeReco(key,recoIM)
+    return(grayIM,recoIM)
+
+def prefetch():
+    # background thread, reconstructs the frames the user is likely to step to next
+    while True:
+        prefetchWake.wait()
+        prefetchWake.clear()
+        key=currentKey
+        try:
+            for step in PREFETCH_STEPS:
+                frame=clamp(key[0]+step,0,MAX_FRAME-2) # same limit as doButton, frame count can be too big
+                if currentKey!=key:         # user moved on, start again around the new image
+                    break
+                if (frame,)+key[1:] not in recoCache:
+                    getFrameReco((frame,)+key[1:])
+        except Exception as e:          # keep prefetching for the next image
+            print('Prefetch error',e)
+
+def setCurrentKey(key):
+    # new image on display, drop reconstructions made at a different crop or Z
+    global currentKey,recoCacheBytes
+    with readerLock:
+        if currentKey is None or key[1:]!=currentKey[1:]:
+            recoCache.clear()
+            recoCacheBytes=0
+        currentKey=key
+    return
 
 def processImage():
     global savePic
     
     updateWindow()
-    cap.set(cv2.CAP_PROP_POS_FRAMES,frameCount)        # point to requested frame
-    ret, rawIM = cap.read()
-    grayIM = cv2.cvtColor(rawIM, cv2.COLOR_BGR2GRAY)
-
+    setCurrentKey((frameCount,tuple(window),Z))
+    grayIM,recoIM=getFrameReco(currentKey)
+    if grayIM is None:
+        print('Could not read frame',frameCount)
+        return
     cropIM=grayIM[window[0]:window[1],window[2]:window[3]] # crop window of image
-    recoIM=reco.recoFrame(cropIM,Z*Z_SCALE)
     rescaleRecoIM=cv2.resize(recoIM,None,fx=displayScale,fy=displayScale)
     rescaleFullIM=cv2.resize(grayIM,None,fx=1.0/FULL_SCALE,fy=1.0/FULL_SCALE)
 
     cv2.imshow('Crop Reconstructed',rescaleRecoIM)
     cv2.imshow('Full Image',rescaleFullIM)
     cv2.waitKey(1)
+    prefetchWake.set()      # prepare the neighbouring frames while the user looks at this one
 
     if savePic==True:
         savePicture(recoIM,cropIM) # save reconstructed and cropped raw image
@@ -227,8 +317,8 @@ doc() # print user guide
     
 #test to see if we can open the video, else quit the program
 print('Opening video file:',vid)
-cap=cv2.VideoCapture(vid)
-goodVideo, frame = cap.read()
+reader=frameReader.FrameReader(vid)
+goodVideo, frame = reader.read(frameCount)
 
 if 'mp4' not in vid:    # can only process mp4 videos!
     goodVideo=0
@@ -247,13 +337,14 @@ if goodVideo:
         c=int(val%4)
         tk.Radiobutton(root, text=txt,padx = 1, variable=v,width=BUTTON_WIDTH,command=doButton,indicatoron=0,value=val).grid(row=r,column=c)
 
+    MAX_FRAME=reader.frameCount
+    print ("Total frames:",MAX_FRAME)
+    threading.Thread(target=prefetch,daemon=True).start()
     processImage()
     cv2.setMouseCallback('Full Image',doMouse)
-    MAX_FRAME=int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-    print ("Total frames:",MAX_FRAME)
 
     root.mainloop()
-    cap.release()
+    reader.release()
     cv2.destroyAllWindows()
     print ('Ending program, bye!')
 else:
@@ -6,6 +6,16 @@ Holgraphic Reconstruction Algorithms by Nick Antipac, UC Berkeley and  Daniel El
 This work is funded by the National Science Foundation (NSF) grant No. DBI-1548297, Center for Cellular Construction.
 Disclaimer:  Any opinions, findings and conclusions or recommendations expressed in this material are those of the authors and do not necessarily reflect the views of the National Science Foundation. 
 
+V14 10.18.26 Added iterRecoChunks, yields each chunk of planes as one array so callers can score a chunk without restacking it
+V13 10.18.26 recoROI folds the phase aberration into its inverse transform (no full size kernel), picks the cheaper product order, reconstructs big regions in full
+V12 10.18.26 Added iterRecoFromE0, stack of planes from an image already transformed with recoE0
+V11 10.18.26 Added recoROI, reconstructs only a region (or line) of the image with a partial inverse transform
+V10 10.18.26 Forward transform uses rfft2 (image is real), fftshift/ifftshift removed since they cancel, kernels hold half the spectrum
+V9 10.18.26 Pad (or crop) images to fast FFT sizes instead of only forcing even dimensions, output keeps the input size when padding
+V8 10.18.26 Optional single precision (float32/complex64) reconstruction, see setPrecision() for error bound
+V7 10.18.26 Selectable FFT backend (numpy, scipy.fft with worker threads, pyFFTW with saved wisdom), falls back to numpy if not installed
+V6 10.18.26 Added recoStack and iterRecoStack, forward FFT (E0) is computed once per image and reused for every Z
+V5 10.18.26 Cache frequency grid (kxy2) and phase aberration kernels in a memory bounded LRU so repeated frames only pay for the FFTs
 V4 09.01.21 Force image to have even dimensions, clip ampIM to 0,255 to prevent rollover during 8 bit conversion
 V3 03.01.21 removed unused background subtraction code
 V2 03.01.21 added description of program
@@ -13,6 +23,37 @@ V1 09.24.19
 '''
 import cv2
 import numpy as np
+import threading
+import atexit
+import pickle
+import os
+from functools import partial
+from collections import OrderedDict
+
+# holo microscope settings
+dxy   = 1.4e-6      # imager pixel (meters)
+wvlen = 650.0e-9    # wavelength of light is red, 650 nm
+
+STACK_CHUNK=8           # number of Z planes propagated together by iterRecoStack, limits memory to STACK_CHUNK complex images
+KERNEL_CACHE_MB=256     # max memory used by cached grids and phase kernels (megabytes), least recently used are dropped first
+FFT_BACKEND='numpy'     # 'numpy', 'scipy' or 'pyfftw', use setFFTBackend() to change while running
+FFT_WORKERS=1           # threads used by the scipy and pyfftw backends, -1 uses all cores
+FFTW_WISDOM_FILE='fftwWisdom.pkl'   # pyfftw plans are saved here so they are only measured once per machine
+
+SIZE_POLICY='pad'       # 'pad' image up to a fast FFT size, 'crop' image down to a fast FFT size, 'even' only drop an odd row/column
+PAD_MODE='edge'         # fill used by 'pad', 'edge' repeats the border pixels, 'mean' uses the image mean
+FAST_FACTORS=(2,3,5,7)  # FFT sizes that only have these prime factors are fast
+PRECISION='double'      # 'double' (float64) or 'single' (float32), use setPrecision() to change while running
+ROI_FULL_RATIO=300      # recoROI reconstructs the full frame and crops when the region costs more than this many multiplies per spectrum value
+
+rfft2=np.fft.rfft2          # FFT functions used for reconstruction, set by setFFTBackend()
+irfft2=np.fft.irfft2
+fftBackend='numpy'          # backend actually in use
+floatType=np.float64        # image type used for reconstruction, set by setPrecision()
+
+kernelCache=OrderedDict()   # (kernel name, M, N, ...) -> read only array, most recently used at the end
+kernelCacheBytes=0          # bytes currently held in kernelCache
+kernelLock=threading.Lock() # reconstruction may be called from several threads
 
 def openVid(vid):
     cap = cv2.VideoCapture(vid)
@@ -24,45 +65,298 @@ def getFrame(cap,index):
     print('get frame status',cap,ret)
     return(ret,rawFrame)
 
-def propagate(input_img, wvlen, zdist, dxy):
-    M, N = input_img.shape # get image size, rows M, columns N, they must be even numbers!
-    
-    # prepare grid in frequency space with origin at 0,0
-    _x1 = np.arange(0,N/2)
-    _x2 = np.arange(N/2,0,-1)
-    _y1 = np.arange(0,M/2)
-    _y2 = np.arange(M/2,0,-1)
-    _x  = np.concatenate([_x1, _x2])
-    _y  = np.concatenate([_y1, _y2])
-    x, y  = np.meshgrid(_x, _y)
-    kx,ky = x / (dxy * N), y / (dxy * M)
-    kxy2  = (kx * kx) + (ky * ky)
-
-    # compute FT at z=0
-    E0 = np.fft.fft2(np.fft.fftshift(input_img))
-
-    # compute phase aberration 
-    _ph_abbr   = np.exp(-1j * np.pi * wvlen * zdist * kxy2)
-    output_img = np.fft.ifftshift(np.fft.ifft2(E0 * _ph_abbr))
+def loadWisdom(pyfftw):
+    if os.path.isfile(FFTW_WISDOM_FILE):
+        with open(FFTW_WISDOM_FILE,'rb') as f:
+            pyfftw.import_wisdom(pickle.load(f))
+    return
+
+def saveWisdom():
+    import pyfftw
+    with open(FFTW_WISDOM_FILE,'wb') as f:
+        pickle.dump(pyfftw.export_wisdom(),f)
+    return
+
+def setFFTBackend(backend=FFT_BACKEND,workers=FFT_WORKERS):
+    # select the FFT library used by propagate, returns the backend actually selected
+    global rfft2,irfft2,fftBackend
+    if workers<1:
+        workers=os.cpu_count()
+    rfft2=np.fft.rfft2; irfft2=np.fft.irfft2; fftBackend='numpy' # default and fallback
+    if backend=='scipy':
+        try:
+            import scipy.fft
+            rfft2=partial(scipy.fft.rfft2,workers=workers)
+            irfft2=partial(scipy.fft.irfft2,workers=workers)
+            fftBackend='scipy'
+        except ImportError:
+            print('scipy not installed, using numpy FFT')
+    elif backend=='pyfftw':
+        try:
+            import pyfftw
+            import pyfftw.interfaces.numpy_fft as fftw
+            pyfftw.interfaces.cache.enable()        # keep FFTW plans between calls
+            loadWisdom(pyfftw)
+            atexit.unregister(saveWisdom)            # only register once if called again
+            atexit.register(saveWisdom)
+            rfft2=partial(fftw.rfft2,threads=workers,planner_effort='FFTW_MEASURE')
+            irfft2=partial(fftw.irfft2,threads=workers,planner_effort='FFTW_MEASURE')
+            fftBackend='pyfftw'
+        except ImportError:
+            print('pyfftw not installed, using numpy FFT')
+    elif backend!='numpy':
+        print('Unknown FFT backend',backend,'using numpy FFT')
+    return(fftBackend)
+
+def setPrecision(precision=PRECISION):
+    # 'single' halves memory and FFT work. Compared to 'double' the 8 bit reconstruction differs by at most
+    # 1 gray level (float32 FFT error is ~1e-6 of full scale, so only pixels sitting on a rounding boundary change)
+    # Note numpy older than 2.0 always does FFTs in double, use the scipy or pyfftw backend to get single precision FFTs
+    global floatType
+    if precision=='single':
+        floatType=np.float32
+    elif precision=='double':
+        floatType=np.float64
+    else:
+        print('Unknown precision',precision,'using double')
+        floatType=np.float64
+    return
+
+def getCached(key,makeKernel):
+    # return kernel stored under key, calling makeKernel() to create it when it is not in the cache
+    global kernelCacheBytes
+    with kernelLock:
+        if key in kernelCache:
+            kernelCache.move_to_end(key)    # mark as most recently used
+            return(kernelCache[key])
+    kernel=makeKernel()                     # build outside the lock so other threads are not blocked
+    kernel.setflags(write=False)            # shared between callers, nobody may modify it
+    with kernelLock:
+        if key not in kernelCache:
+            kernelCache[key]=kernel
+            kernelCacheBytes+=kernel.nbytes
+        while kernelCacheBytes>KERNEL_CACHE_MB*1e6 and len(kernelCache)>1: # always keep the newest kernel
+            oldKey,oldKernel=kernelCache.popitem(last=False)
+            kernelCacheBytes-=oldKernel.nbytes
+        return(kernelCache.get(key,kernel))
+
+def clearKernelCache():
+    global kernelCacheBytes
+    with kernelLock:
+        kernelCache.clear()
+        kernelCacheBytes=0
+    return
+
+def getKxy2(M,N,dxy):
+    # squared spatial frequency grid with origin at 0,0 for an image of M rows and N columns
+    # only columns 0..N/2 are kept because rfft2 only returns that half of the spectrum
+    def makeKxy2():
+        kx  = np.fft.rfftfreq(N,dxy)          # 0,1,2..N/2 / (dxy*N)
+        ky  = np.abs(np.fft.fftfreq(M,dxy))   # 0,1,2..M/2..2,1 / (dxy*M)
+        return((kx * kx)[np.newaxis,:] + (ky * ky)[:,np.newaxis]) # same as meshgrid, without the two full size grids
+    return(getCached(('kxy2',M,N,dxy),makeKxy2))
+
+def makePhaseParts(kxy2,wvlen,zdist,dtype):
+    # phase aberration exp(-i*theta) split into real and imaginary parts, stacked as [...,2,M,N/2+1]
+    theta=np.pi * wvlen * np.multiply.outer(zdist,kxy2) # phase always computed in double, it can be thousands of radians
+    return(np.stack([np.cos(theta),-np.sin(theta)],axis=-3).astype(dtype,copy=False))
+
+def getPhaseAbbr(M,N,dxy,wvlen,zdist,dtype=np.float64):
+    # phase aberration kernel that propagates the wavefront a distance zdist
+    def makePhaseAbbr():
+        return(makePhaseParts(getKxy2(M,N,dxy),wvlen,zdist,dtype))
+    return(getCached(('phAbbr',M,N,dxy,wvlen,zdist,np.dtype(dtype).name),makePhaseAbbr))
+
+def getE0(input_img):
+    # compute FT at z=0, only depends on the image so it can be reused for any z
+    # the image is real so rfft2 gives the same information as fft2 in half the time and memory
+    # the original fftshift before fft2 and ifftshift after ifft2 cancel each other, so they are not done
+    return(rfft2(input_img))
+
+def propagateParts(E0, _ph_abbr, M, N):
+    # The image is real and the kernel is symmetric, so the real and imaginary parts of the wavefront
+    # are each the inverse of a Hermitian half spectrum. Both are done with one real inverse FFT.
+    return(irfft2(E0[...,np.newaxis,:,:] * _ph_abbr, s=(M,N)))
+
+def propagateE0(E0, wvlen, zdist, dxy, N=None):
+    # E0 is the rfft2 half spectrum, N is the number of image columns (assumed even if not given)
+    M = E0.shape[-2]     # get image size, rows M, columns N
+    if N is None:
+        N=2*(E0.shape[-1]-1)
+
+    # apply phase aberration, grid and kernel are reused from previous calls with the same size and z
+    _ph_abbr   = getPhaseAbbr(M,N,dxy,wvlen,zdist,E0.real.dtype)
+    parts      = propagateParts(E0, _ph_abbr, M, N)
+    output_img = parts[...,0,:,:] + 1j * parts[...,1,:,:]
     return output_img
 
-def recoFrame(cropIM,z): 
-    # holo microscope settings
-    dxy   = 1.4e-6      # imager pixel (meters)
-    wvlen = 650.0e-9    # wavelength of light is red, 650 nm
+def propagate(input_img, wvlen, zdist, dxy):
+    return(propagateE0(getE0(input_img), wvlen, zdist, dxy, input_img.shape[1]))
 
+def isFastLen(n):
+    for f in FAST_FACTORS:
+        while n%f==0:
+            n//=f
+    return(n==1)
+
+def nextFastLen(n):
+    # smallest even fast FFT size >= n, even so the image width can be recovered from the rfft2 half spectrum
+    n+=n%2
+    while not isFastLen(n):
+        n+=2
+    return(n)
+
+def prevFastLen(n):
+    # largest even fast FFT size <= n
+    n-=n%2
+    while n>2 and not isFastLen(n):
+        n-=2
+    return(n)
+
+def evenCrop(cropIM):
     #make even coordinates
     (yRez,xRez)=cropIM.shape
     if (xRez%2)==1:
         xRez-=1
     if (yRez%2)==1:
         yRez-=1
-    cropIM=cropIM[0:yRez,0:xRez]
+    return(cropIM[0:yRez,0:xRez])
+
+def fitFFTSize(cropIM):
+    # resize image to an FFT friendly size using SIZE_POLICY, padding is added to the bottom and right so pixel locations don't move
+    (yRez,xRez)=cropIM.shape
+    if SIZE_POLICY=='even':
+        return(evenCrop(cropIM))
+    elif SIZE_POLICY=='crop':
+        return(cropIM[0:prevFastLen(yRez),0:prevFastLen(xRez)])
+    padding=((0,nextFastLen(yRez)-yRez),(0,nextFastLen(xRez)-xRez))
+    if PAD_MODE=='mean':
+        return(np.pad(cropIM,padding,mode='constant',constant_values=cropIM.mean()))
+    return(np.pad(cropIM,padding,mode='edge'))
 
-    res = propagate(np.sqrt(cropIM), wvlen, z, dxy)	 # calculate wavefront at z
-    amp=np.abs(res)**2              # output is the complex field, compute intensity
+def recoShape(cropIM):
+    # size of the reconstructed image, same as cropIM unless SIZE_POLICY trims it
+    (yRez,xRez)=cropIM.shape
+    if SIZE_POLICY=='even':
+        return(yRez-yRez%2,xRez-xRez%2)
+    elif SIZE_POLICY=='crop':
+        return(prevFastLen(yRez),prevFastLen(xRez))
+    return(yRez,xRez)
+
+def toIntensity(parts):
+    # parts holds the real and imaginary parts of the wavefront [...,2,M,N]
+    amp=parts[...,0,:,:]**2 + parts[...,1,:,:]**2 # compute intensity
     amp = np.clip(amp,0,255)        # prevent rollover when converting to 8 bit
     ampInt=amp.astype('uint8')  
     return(ampInt)
 
+def recoE0(cropIM):
+    # forward FFT of a cropped image, pass to recoFromE0 with recoShape(cropIM) to reconstruct the same image at many z
+    return(getE0(np.sqrt(fitFFTSize(cropIM),dtype=floatType)))
+
+def recoFromE0(E0,z,shape=None,cache=True):
+    # cache=False for z values used only once (e.g. autofocus searches), so they don't push reused kernels out of the cache
+    M, N = E0.shape[0], 2*(E0.shape[1]-1)   # every SIZE_POLICY gives an even number of columns
+    if cache:
+        _ph_abbr = getPhaseAbbr(M,N,dxy,wvlen,z,E0.real.dtype)
+    else:
+        _ph_abbr = makePhaseParts(getKxy2(M,N,dxy),wvlen,z,E0.real.dtype)
+    res = propagateParts(E0, _ph_abbr, M, N) # calculate wavefront at z
+    if shape is not None:
+        res=res[...,0:shape[0],0:shape[1]]  # remove FFT padding
+    return(toIntensity(res))
+
+def recoFrame(cropIM,z): 
+    return(recoFromE0(recoE0(cropIM),z,recoShape(cropIM)))
+
+def iterRecoStack(cropIM,zList,chunk=STACK_CHUNK):
+    # yield (z,ampIM) for each z in zList, only chunk planes are held in memory at a time
+    E0=recoE0(cropIM)                                   # one forward FFT for the whole stack
+    return(iterRecoFromE0(E0,zList,recoShape(cropIM),chunk))
+
+def iterRecoChunks(E0,zList,shape,chunk=STACK_CHUNK):
+    # yield (zChunk,ampStack) for every chunk of zList, ampStack is uint8 (len(zChunk),rows,columns), shape=recoShape(cropIM)
+    (yRez,xRez)=shape
+    M, N = E0.shape[0], 2*(E0.shape[1]-1)
+    kxy2=getKxy2(M,N,dxy)
+    zList=np.asarray(zList,dtype=float)
+    for i in range(0,len(zList),chunk):
+        zChunk=zList[i:i+chunk]
+        _ph_abbr=makePhaseParts(kxy2,wvlen,zChunk,E0.real.dtype) # one kernel per z, not cached
+        res=propagateParts(E0, _ph_abbr, M, N)
+        yield(zChunk,toIntensity(res[...,0:yRez,0:xRez]))
+
+def iterRecoFromE0(E0,zList,shape,chunk=STACK_CHUNK):
+    # same as iterRecoStack for an image already transformed with recoE0, shape=recoShape(cropIM)
+    for zChunk,ampStack in iterRecoChunks(E0,zList,shape,chunk):
+        for z,ampIM in zip(zChunk,ampStack):
+            yield(z,ampIM)
+
+def recoStack(cropIM,zList):
+    # reconstruct cropIM at every z in zList, returns uint8 array (len(zList),rows,columns)
+    (yRez,xRez)=recoShape(cropIM)
+    stack=np.empty((len(zList),yRez,xRez),dtype='uint8')
+    for i,(z,ampIM) in enumerate(iterRecoStack(cropIM,zList)):
+        stack[i]=ampIM
+    return(stack)
+
+def getROIBasis(M,N,roi):
+    # inverse transform matrices that only produce the pixels in roi=[y0,y1,x0,x1]
+    def makeRowBasis():
+        k=np.arange(M)
+        r=np.arange(roi[0],roi[1])
+        return(np.exp(2j*np.pi*np.outer(r,k)/M)/(M*N))         # (roi rows,M)
+    def makeColumnBasis():
+        l=np.arange(N//2+1)
+        c=np.arange(roi[2],roi[3])
+        weight=np.full(N//2+1,2.0)  # columns 1..N/2-1 stand for themselves and their mirror image
+        weight[0]=1
+        if N%2==0:
+            weight[-1]=1
+        return(weight[:,np.newaxis]*np.exp(2j*np.pi*np.outer(l,c)/N))   # (N/2+1,roi columns)
+    rowBasis=getCached(('roiRows',M,N,roi[0],roi[1]),makeRowBasis)
+    columnBasis=getCached(('roiColumns',M,N,roi[2],roi[3]),makeColumnBasis)
+    return(rowBasis,columnBasis)
+
+def getPhaseVectors(M,N,dxy,wvlen,zdist):
+    # kxy2=ky^2+kx^2, so the phase aberration angle is a row angle plus a column angle
+    # returns cos and sin of both, M+N/2+1 values instead of a full size kernel
+    thetaY=np.pi*wvlen*zdist*np.fft.fftfreq(M,dxy)**2
+    thetaX=np.pi*wvlen*zdist*np.fft.rfftfreq(N,dxy)**2
+    return(np.cos(thetaY),np.sin(thetaY),np.cos(thetaX),np.sin(thetaX))
+
+def recoROIFromE0(E0,z,roi):
+    # reconstruct only roi=[y0,y1,x0,x1] of the image at z, same pixels as recoFrame(cropIM,z)[y0:y1,x0:x1]
+    # the phase aberration is folded into the inverse transform matrices, so no full size kernel is made (or cached)
+    # and a line or small region costs a fraction of a full frame, big regions are reconstructed in full and cropped
+    M, N = E0.shape[0], 2*(E0.shape[1]-1)
+    h, w = roi[1]-roi[0], roi[3]-roi[2]
+    L = N//2+1
+    columnsFirst = M*L*w + 2*h*M*w      # multiplies for each order of the two matrix products
+    rowsFirst = h*M*L + 2*h*L*w
+    if min(columnsFirst,rowsFirst) > ROI_FULL_RATIO*M*L:
+        return(recoFromE0(E0,z,cache=False)[roi[0]:roi[1],roi[2]:roi[3]])
+
+    rowBasis,columnBasis=getROIBasis(M,N,roi)
+    cy,sy,cx,sx=getPhaseVectors(M,N,dxy,wvlen,z)
+    # cos(thetaY+thetaX)=cy*cx-sy*sx and -sin(thetaY+thetaX)=-(sy*cx+cy*sx)
+    if columnsFirst<=rowsFirst:
+        X = E0 @ np.stack([cx[:,np.newaxis]*columnBasis, sx[:,np.newaxis]*columnBasis])   # [cos,sin] x (M,roi columns)
+        Rc = cy[np.newaxis,:]*rowBasis
+        Rs = sy[np.newaxis,:]*rowBasis
+        real = Rc@X[0] - Rs@X[1]
+        imag = -(Rs@X[0] + Rc@X[1])
+    else:
+        Y = np.stack([cy[np.newaxis,:]*rowBasis, sy[np.newaxis,:]*rowBasis]) @ E0          # [cos,sin] x (roi rows,N/2+1)
+        Cc = cx[:,np.newaxis]*columnBasis
+        Cs = sx[:,np.newaxis]*columnBasis
+        real = Y[0]@Cc - Y[1]@Cs
+        imag = -(Y[1]@Cc + Y[0]@Cs)
+    parts = np.stack([real.real,imag.real]).astype(E0.real.dtype,copy=False)   # real and imaginary parts of the wavefront
+    return(toIntensity(parts))
+
+def recoROI(cropIM,z,roi):
+    return(recoROIFromE0(recoE0(cropIM),z,roi))
 
+setFFTBackend()     # use FFT_BACKEND and FFT_WORKERS settings
+setPrecision()      # use PRECISION setting
@@ -0,0 +1,128 @@
+'''
+Reconstruct a whole holographic video at a fixed Z without a display, e.g. overnight runs on long plankton recordings
+
+The work is split into stages connected by bounded queues so every core is kept busy:
+    decode thread: reads frames in order, converts to grayscale and crops
+    reconstruction pool: several frames are reconstructed at the same time (threads or processes)
+    writer (main thread): writes reconstructed frames in frame order to an mp4 or an image directory
+
+Set the USER SETTINGS below and run, or import and call runPipeline() from another program.
+Output images are named like the other programs, e.g. M6_23_3000_reco.jpg where "23" is the frame number and "3000" is z (microns)
+
+V1 10.18.26
+V2 10.18.26 an error in the decode thread stops the run instead of leaving the writer waiting
+Thomas Zimmerman, IBM Research-Almaden
+Holgraphic Reconstruction Algorithms by Nick Antipac, UC Berkeley and  Daniel Elnatan, UCSF
+This work is funded by the National Science Foundation (NSF) grant No. DBI-1548297, Center for Cellular Construction.
+Disclaimer:  Any opinions, findings and conclusions or recommendations expressed in this material are those of the authors and do not necessarily reflect the views of the National Science Foundation.
+'''
+
+import cv2
+import os
+import time
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import reco                 # performs reconstruction
+
+########## USER SETTINGS ##############################
+vid=r'\rawVideo\M6.mp4'     # video to reconstruct, must be mp4
+outName=r'\recoVideo\M6_reco.mp4'   # output mp4, or a directory to save one jpg per frame
+Z=3000                      # reconstruction z (microns)
+Z_SCALE=1e-6                # convert z units to microns
+window=None                 # crop window [y0,y1,x0,x1] of the full frame, None reconstructs the full frame
+EVERY=1                     # reconstruct every Nth frame
+WORKERS=os.cpu_count()      # reconstructions running at the same time
+USE_PROCESSES=False         # threads work well since the FFTs release the GIL, processes avoid the GIL for everything else
+QUEUE_SIZE=2*WORKERS        # max frames waiting between stages, limits memory
+
+################# FUNCTIONS #################
+def cropFrame(rawIM,window):
+    grayIM = cv2.cvtColor(rawIM, cv2.COLOR_BGR2GRAY)
+    if window is None:
+        return(grayIM)
+    return(grayIM[window[0]:window[1],window[2]:window[3]]) # crop window of image
+
+def decodeFrames(cap,window,every,pool,z,recoQueue,stop):
+    # decode stage: read frames in order, submit each kept frame for reconstruction
+    frameCount=0
+    try:
+        while not stop.is_set():
+            if frameCount%every==0:
+                ret, rawIM = cap.read()
+                if not ret:
+                    break
+                cropIM=cropFrame(rawIM,window)
+                recoQueue.put((frameCount,pool.submit(reco.recoFrame,cropIM,z))) # blocks when the queue is full
+            elif not cap.grab():    # skipped frames are not converted to images
+                break
+            frameCount+=1
+    except Exception as e:
+        recoQueue.put(e)        # the writer raises it, so the run fails instead of waiting forever
+    finally:
+        recoQueue.put(None)     # tell the writer we are done
+    return
+
+def openWriter(outName,prefix,zName,shape,fps):
+    # returns a function that saves one reconstructed frame and a function that closes the output
+    if outName.lower().endswith('.mp4'):
+        (yRez,xRez)=shape
+        writer=cv2.VideoWriter(outName,cv2.VideoWriter_fourcc(*'mp4v'),fps,(xRez,yRez),isColor=False)
+        return(lambda frameCount,recoIM: writer.write(recoIM), writer.release)
+    os.makedirs(outName,exist_ok=True)
+    def saveImage(frameCount,recoIM):
+        cv2.imwrite(os.path.join(outName,prefix+'_'+str(frameCount)+'_'+zName+'_reco.jpg'),recoIM)
+    return(saveImage, lambda: None)
+
+def runPipeline(vid,outName,z,window=None,every=1,workers=WORKERS,useProcesses=USE_PROCESSES,queueSize=QUEUE_SIZE):
+    # reconstruct every Nth frame of vid at z (meters), returns number of frames written and seconds taken
+    cap=cv2.VideoCapture(vid)
+    if not cap.isOpened():
+        print('Could not open video file:',vid)
+        return(0,0)
+    fps=cap.get(cv2.CAP_PROP_FPS)/every
+
+    Executor=ProcessPoolExecutor if useProcesses else ThreadPoolExecutor
+    recoQueue=queue.Queue(maxsize=queueSize)   # futures in frame order
+    stop=threading.Event()
+    startTime=time.time()
+    frames=0
+    save=None
+    with Executor(max_workers=workers) as pool:
+        decoder=threading.Thread(target=decodeFrames,args=(cap,window,every,pool,z,recoQueue,stop),daemon=True)
+        decoder.start()
+        try:
+            while True:
+                item=recoQueue.get()
+                if item is None:
+                    break
+                if isinstance(item,Exception):
+                    raise item          # decoding failed
+                frameCount,future=item
+                recoIM=future.result()
+                if save is None:        # output size is known after the first reconstruction
+                    prefix=os.path.splitext(os.path.basename(vid))[0]
+                    save,close=openWriter(outName,prefix,str(round(z/Z_SCALE)),recoIM.shape,fps)
+                save(frameCount,recoIM)
+                frames+=1
+                if frames%100==0:
+                    print('frame',frameCount,'frames/s',round(frames/(time.time()-startTime),1))
+        finally:
+            stop.set()                  # stop decoding if the writer failed
+            while decoder.is_alive():   # unblock the decoder if it is waiting on a full queue
+                try:
+                    recoQueue.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            if save is not None:
+                close()
+            cap.release()
+    seconds=time.time()-startTime
+    return(frames,seconds)
+
+################################ MAIN ##################################
+if __name__=='__main__':   # needed so processes started by the pool don't rerun the main program
+    print('Reconstructing',vid,'at z =',Z,'to',outName)
+    frames,seconds=runPipeline(vid,outName,Z*Z_SCALE,window,EVERY)
+    if seconds>0:
+        print('Done,',frames,'frames in',round(seconds,1),'seconds,',round(frames/seconds,1),'frames/s')
@@ -1,6 +1,9 @@
 '''
 Interactive Holographic Reconstruction with Tkinter Interface with Line Contrast Display
 
+V10 10.18.26 Buttons and mouse only change settings, the loop redraws at most DRAW_FPS times a second, status label and line plot are reused (blitting)
+V9 10.18.26 Camera is read in its own thread (frameReader.LiveCapture), display uses the newest frame and reports dropped frames
+V8 10.18.26 Background autofocus sweeps Z around the current Z on the latest frame, AutoFocus On locks Z to the best Z found
 V7 10.01.21 Added change line length, fixed Display size bug, removed all vid, MP4 and Frame reference, removed all image directory (now puts in same directory as running program) 
 V6 09.30.21 Removed Frame, video link, cwd (working directory) from code
 
@@ -22,6 +25,8 @@ SavePic: Saves reconstructed cropped image, image format= 2_holo.jpg and 2_3000_
         "raw" is the original cropped holographic image
         "holo" is the image reconstructed at distance z (3000um in this example)
 Center: To center cropped image, press "Center", place cursor over center object, then left click
+AutoFocus: A background sweep keeps looking for the Z with the best line contrast around the current Z (shown as "auto" in the plot title).
+        "AutoFocus On" sets Z to that value every time the sweep finishes, "AutoFocus Off" goes back to manual Z
 To end program, click 'X' in top right of button panel
 
 General Use Guide
@@ -42,6 +47,10 @@ Disclaimer:  Any opinions, findings and conclusions or recommendations expressed
 
 import tkinter as tk
 import reco                 # performs reconstruction
+import autofocus            # finds best reconstruction z
+import frameReader          # camera capture thread
+import threading
+import time
 import cv2
 import numpy as np
 from matplotlib import pyplot as plt
@@ -68,6 +77,22 @@ y=150
 lineLen=200             # length of contrast plotting line
 maxContrast=0           # result of contrast calculation
 bestZ=0
+AUTO_RANGE=200          # background autofocus searches Z-AUTO_RANGE to Z+AUTO_RANGE (um)
+AUTO_TOL=5              # background autofocus stops when best Z is known to within this (um)
+autoZ=0                 # best Z found by background autofocus
+autoContrast=0          # line contrast at autoZ
+lockZ=False             # when True, Z follows autoZ
+sweepJob=None           # (cropIM,Z,roi) for the background autofocus, newest frame replaces older ones
+sweepLock=threading.Lock()
+sweepWake=threading.Event()
+REPORT_SECONDS=10       # print camera and reconstruction frame rates this often
+recoCount=0             # frames reconstructed since the last report
+reportTime=0            # time of the last report
+DRAW_FPS=30             # most redraws per second, button and mouse events in between are drawn together
+redrawNeeded=False      # set by buttons and mouse, redraw now with the newest frame instead of waiting for the next one
+statusLabel=None        # status line, made once and updated
+plotBackground=None     # line plot without the line and title, restored before every redraw (blitting)
+lastDraw=0              # time of the last redraw
 # Button names. Some are left blank for future functions.
 names = [
     ("X -10"),
@@ -86,8 +111,8 @@ names = [
     ("Line +10"),
     ("Display -1"),
     ("Display +1"), 
-    (" "), 
-    (" "),
+    ("AutoFocus On"), 
+    ("AutoFocus Off"),
     ("SavePic"),
     ("Center")
 ]
@@ -108,17 +133,22 @@ def doc():
     print()
     
 def doMouse(event,x,y,flags,param):
-    global getCenter,xc,yc
+    # only changes settings, the main loop redraws
+    global getCenter,xc,yc,redrawNeeded
 
-    processImage()
     if getCenter and event == cv2.EVENT_LBUTTONDOWN:
         xc,yc = x*FULL_SCALE,y*FULL_SCALE # compensate for full scale scaling
-        processImage()
+        redrawNeeded=True
     return
 
 def updateStatusDisplay():
+    global statusLabel
     textOut=' x='+ str(x) + '    y='+ str(y) + '    Crop=' + str(CROP) + '    Z=' + str(Z) + '    Display=' + str(displayScale)+'   '
-    tk.Label(root, text=textOut,bg="yellow",justify = tk.LEFT).grid(row=0,column=0,columnspan=4)
+    if statusLabel is None:
+        statusLabel=tk.Label(root, text=textOut,bg="yellow",justify = tk.LEFT)
+        statusLabel.grid(row=0,column=0,columnspan=4)
+    else:
+        statusLabel.config(text=textOut)
     return
 
 def savePicture(holoIM,cropIM):
@@ -154,7 +184,8 @@ def updateWindow():
     return
 
 def doButton():
-    global x,y,displayScale,Z,CROP,getCenter,savePic,bkgState,bkgIM,maxContrast,lineLen
+    # only changes settings, the main loop redraws
+    global x,y,displayScale,Z,CROP,getCenter,savePic,bkgState,bkgIM,maxContrast,lineLen,lockZ,redrawNeeded
 
     getCenter=False #clear flag in case button is not Center, allows multiple centers until another button pushed
     val=v.get()
@@ -174,6 +205,8 @@ def doButton():
         getCenter=True  # this flag tells doCenter to update xc,yc
     elif 'SavePic' in but:
         savePic=True  # flag indicates picture capture requested
+    elif 'AutoFocus' in but:
+        lockZ='On' in but   # Z follows the background autofocus
     elif 'X' in but:
         x+=increment
         maxContrast=0
@@ -200,7 +233,7 @@ def doButton():
            lineLen=1
     
     updateStatusDisplay()
-    processImage()
+    redrawNeeded=True
     return
 
 def doLine(im):
@@ -225,22 +258,101 @@ def plotLineIntensity(im):
     if contrast>maxContrast:
         maxContrast=contrast
         bestZ=Z
-    plt.clf()
-    plt.title('Contrast ='+str(contrast)+' ('+ str(maxContrast)+ ')   z =' + str(Z) + ' ('+str(bestZ)+')')
-    plt.xlabel('y')
-    plt.ylabel('Intensity')
-    plt.ylim([0, 255])              # limit y range
-    plt.xlim([0, lineLen])         # limit x range
-    plt.plot(im[y:y+lineLen,x])
+    profile=im[y:y+lineLen,x]
+    if ax.get_xlim()[1]!=lineLen:
+        ax.set_xlim([0, lineLen])   # limit x range, axis changed so draw everything and save a new background
+        fig.canvas.draw()
+    linePlot.set_data(np.arange(len(profile)),profile)
+    titleText.set_text('Contrast ='+str(contrast)+' ('+ str(maxContrast)+ ')   z =' + str(Z) + ' ('+str(bestZ)+')   auto ='+str(autoZ)+(' locked' if lockZ else ''))
+    if plotBackground is not None and fig.canvas.supports_blit:
+        fig.canvas.restore_region(plotBackground)   # only redraw the line and title
+        ax.draw_artist(linePlot)
+        fig.draw_artist(titleText)
+        fig.canvas.blit(fig.bbox)
+    else:
+        fig.canvas.draw_idle()
+    fig.canvas.flush_events()
+
+def setupPlot():
+    # make the line plot once, plotLineIntensity() only changes the line and title
+    global fig,ax,linePlot,titleText
+    fig,ax=plt.subplots()
+    ax.set_xlabel('y')
+    ax.set_ylabel('Intensity')
+    ax.set_ylim([0, 255])           # limit y range
+    ax.set_xlim([0, lineLen])       # limit x range
+    blit=fig.canvas.supports_blit
+    linePlot,=ax.plot([],[],animated=blit)     # animated artists are left out of full draws and drawn by blitting
+    titleText=ax.set_title('',animated=blit)
+    fig.canvas.mpl_connect('draw_event',savePlotBackground)
+    plt.show(block=False)
+    fig.canvas.draw()
+    return
+
+def savePlotBackground(event):
+    # called after every full draw of the plot (start, resize, axis change)
+    global plotBackground
+    if fig.canvas.supports_blit:
+        plotBackground=fig.canvas.copy_from_bbox(fig.bbox)
+    return
     
-def processImage():
-    global savePic
+def autoSweep():
+    # background thread, finds the Z with the best line contrast near the current Z on the newest frame
+    global autoZ,autoContrast,Z,sweepJob
+    while True:
+        sweepWake.wait()
+        with sweepLock:
+            job=sweepJob
+            sweepJob=None
+            sweepWake.clear()
+        if job is None:
+            continue
+        (cropIM,zNow,roi)=job
+        zMin=max(zNow-AUTO_RANGE,1)
+        zBest,contrast=autofocus.findBestZ(cropIM,zMin*Z_SCALE,(zNow+AUTO_RANGE)*Z_SCALE,'contrast',tol=AUTO_TOL*Z_SCALE,roi=roi)
+        autoZ=int(round(zBest/Z_SCALE))
+        autoContrast=round(contrast,2)
+        if lockZ:
+            Z=autoZ
+
+def startSweep(cropIM):
+    # hand the newest frame to the background autofocus, an older frame not started yet is dropped
+    global sweepJob
+    (yCropRez,xCropRez)=cropIM.shape
+    xLine=clamp(x,0,xCropRez-1)
+    yLine=clamp(y,0,yCropRez-1)
+    roi=[yLine,min(yLine+lineLen,yCropRez),xLine,xLine+1]  # the contrast line
+    with sweepLock:
+        sweepJob=(cropIM.copy(),Z,roi)
+        sweepWake.set()
+    return
+
+def reportRates():
+    # print camera and reconstruction frame rates and frames dropped because reconstruction was slower than the camera
+    global recoCount,reportTime,lastCaptured,lastDropped
+    recoCount+=1
+    now=time.time()
+    if now-reportTime>=REPORT_SECONDS:
+        seconds=now-reportTime
+        print('Camera',round((cam.captured-lastCaptured)/seconds,1),'fps   Reconstruction',round(recoCount/seconds,1),'fps   Dropped',cam.dropped-lastDropped,'frames (total',cam.dropped,')')
+        recoCount=0; reportTime=now
+        lastCaptured=cam.captured; lastDropped=cam.dropped
+    return
+
+def processImage(wait=True):
+    # wait=True waits for a new camera frame, after a setting change the newest frame is redrawn without waiting
+    global savePic,redrawNeeded,lastDraw
     
+    redrawNeeded=False
+    lastDraw=time.time()
     updateWindow()
-    ret, rawIM = cap.read()
+    ret, rawIM = cam.read(wait)
+    if not ret:
+        return
     grayIM = cv2.cvtColor(rawIM, cv2.COLOR_BGR2GRAY)
     cropIM=grayIM[window[0]:window[1],window[2]:window[3]] # crop window of image
     recoIM=reco.recoFrame(cropIM,Z*Z_SCALE)
+    startSweep(cropIM)
     plotLineIntensity(recoIM)
     recoIM=doLine(recoIM)
     rescaleRecoIM=cv2.resize(recoIM,None,fx=displayScale,fy=displayScale)
@@ -248,7 +360,8 @@ def processImage():
 
     cv2.imshow('Crop Reconstructed',rescaleRecoIM)
     cv2.imshow('Full Image',rescaleFullIM)
-    cv2.waitKey(10)
+    cv2.waitKey(1)      # no need to wait, cam.read() waits for the next frame
+    reportRates()
 
     if savePic==True:
         savePicture(recoIM,cropIM) # save reconstructed and cropped raw image
@@ -260,10 +373,10 @@ clamp = lambda value, minv, maxv: max(min(value, maxv), minv)
 
 doc() # print user guide
 plt.ion()
-plt.figure()    
-cap = cv2.VideoCapture(MICROSCOPE_CAM) # select external web camera (microscope)
-cap.set(3, 1920); cap.set(4, 1080); # set to 1080p resolution
-goodVideo, frame = cap.read()
+setupPlot()
+cam = frameReader.LiveCapture(MICROSCOPE_CAM,1920,1080) # select external web camera (microscope) at 1080p resolution, read in its own thread
+goodVideo, frame = cam.read()
+lastCaptured=0; lastDropped=0; reportTime=time.time()
 
 count=0    
 if goodVideo:
@@ -279,17 +392,22 @@ if goodVideo:
         c=int(val%4)
         tk.Radiobutton(root, text=txt,padx = 1, variable=v,width=BUTTON_WIDTH,command=doButton,indicatoron=0,value=val).grid(row=r,column=c)
 
+    threading.Thread(target=autoSweep,daemon=True).start()
     processImage()
     cv2.setMouseCallback('Full Image',doMouse)
     MAX_FRAME=32000
     
     try:
-        while True:
-            processImage()
-            root.update()
+        while cam.isOpened():   # stops if the camera is unplugged
+            root.update()       # button presses only change settings, all of them are drawn by the next redraw
+            delay=lastDraw+1.0/DRAW_FPS-time.time()
+            if delay>0:
+                time.sleep(delay)   # redraw at most DRAW_FPS times a second
+            processImage(wait=not redrawNeeded)
     except:
         pass
-    cap.release()
+    cam.release()
+    print('Captured',cam.captured,'frames, dropped',cam.dropped)
     cv2.destroyAllWindows()
     plt.close()
     print ('Ending program, bye!')
@@ -1,6 +1,7 @@
 '''
 Functions useful for tracking objects
 
+v2 10.18.26 Rows of a frame come from detections.DetectionStore instead of searching the whole table with np.where
 v1 09.23.2021
 Tom Zimmerman CCC, IBM Research March 2020
 This work is funded by the National Science Foundation (NSF) grant No. DBI-1548297, Center for Cellular Construction.
@@ -8,28 +9,33 @@ Disclaimer:  Any opinions, findings and conclusions or recommendations expressed
 '''
 
 import numpy as np
+import detections   # frame indexed detection store
 
 detectFileName='detection.csv'      # output file containing object location, area, aspect ratio for each video frame
 FRAME=0; ID=1;  X0=2;   Y0=3;   X1=4;   Y1=5;   XC=6;   YC=7; AREA=8; AR=9; ANGLE=10; MAX_COL=11 # pointers to detection features
 
 data=np.loadtxt(detectFileName,delimiter=',',skiprows=1)
+store=detections.DetectionStore(data)  # sorts rows by frame once and remembers where each frame starts
+data=store.data     # same rows in frame order
 print('data shape',data.shape)
 
-maxFrames=len(np.unique(data[:,FRAME]))
+maxFrames=store.frameCount
 print('max frames',maxFrames)
 
-# get index of all rows with Frame==1
-frame1_index=np.where(data[:,FRAME]==1)
-print('frame1_index',frame1_index,'type',type(frame1_index))
-
-# a tuple is an immutable list (values can't be changed)
-f1=frame1_index[0]
+# get index of all rows with Frame==1, same as np.where(data[:,FRAME]==1)[0] without searching the whole table
+f1=store.rows(1)
 print('f1',f1,'shape',f1.shape)
 
 # get index of all rows with Frame==2
-f2=np.where(data[:,FRAME]==2)[0]
+f2=store.rows(2)
 print('f2',f2,'shape',f2.shape)
 
+# detections of every frame, one pass over the table
+maxObjects=0
+for frame,frameData in store.iterFrames():
+    maxObjects=max(maxObjects,len(frameData))
+print('most objects in one frame',maxObjects)
+
 # create list of object locations in frame 2
 xc2=data[f2,XC]
 print('xc2',xc2)
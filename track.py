@@ -0,0 +1,246 @@
+'''
+Track objects over all the frames of a detection file and save them with a track ID in track.csv
+
+Every frame, the distance from every active track to every detected object is calculated at once (numpy broadcasting)
+and objects are matched to tracks with the Hungarian algorithm (scipy linear_sum_assignment), so the total distance
+is the smallest and no track gets two objects. Pairs further apart than MAX_DISTANCE are never matched (gating),
+an object without a match starts a new track and a track not matched for MAX_MISSED frames ends.
+
+With thousands of objects per frame the full distance matrix is too big, so above KD_TREE_PAIRS track-object pairs
+a KD tree (scipy cKDTree) finds only the pairs closer than MAX_DISTANCE. Tracks and objects linked by those pairs
+form small groups that can't affect each other, each group is matched on its own and a group of one track and one
+object needs no matching at all, so tracking time grows with the number of objects instead of its square.
+
+Every track has a constant velocity Kalman filter that predicts where the object is in the next frame, so fast
+swimmers are looked for where they are going instead of where they were. The gate around each prediction is
+GATE_SIGMAS times the position uncertainty, small for tracks followed for a few frames (fewer candidate pairs,
+fewer ID swaps) and up to MAX_DISTANCE for new tracks whose speed isn't known yet. Track states are kept in arrays,
+position and velocity (tracks,4) and covariance (tracks,4,4), so all tracks are predicted and updated at once.
+
+track.csv has the same columns as detection.csv (FRAME,ID,X0,Y0,X1,Y1,XC,YC,AREA,AR,ANGLE),
+ID is the track ID instead of the object number in the frame.
+trackSummary.csv has one line per track, TRACK,FIRST_FRAME,LAST_FRAME,POINTS, written when the track ends.
+
+The tracker only keeps the active tracks, so it can also run inside a detection loop (see detect.py) on a live
+camera or a video of any length: give it each frame's detections as they are found, write the rows with their
+track IDs with a detections.DetectionTable and ended tracks go to the summary file, memory stays bounded.
+Online IDs can differ a little from track.py run afterwards: online tracking uses the float XC,YC of each object
+(detection.csv truncates them to integers) and also predicts through frames without detections.
+
+Usage
+python track.py                     # detection.csv -> track.csv, see SETTINGS
+
+tracker=Tracker()
+for frame,frameData in store.iterFrames():
+    ids=tracker.update(frame,frameData)     # also writes the track IDs into frameData[:,ID]
+tracker.close()                             # write the tracks still active to the summary file
+
+V1 10.18.26
+V2 10.18.26 KD tree candidate pairs within the gate, matched per connected group, for dense frames
+V3 10.18.26 Constant velocity Kalman filter predicts track positions, gates sized by the prediction uncertainty
+V4 10.18.26 Ended tracks streamed to a summary file, so the tracker can run online inside detect.py
+Tom Zimmerman CCC, IBM Research
+This work is funded by the National Science Foundation (NSF) grant No. DBI-1548297, Center for Cellular Construction.
+Disclaimer:  Any opinions, findings and conclusions or recommendations expressed in this material are those of the authors and do not necessarily reflect the views of the National Science Foundation.
+'''
+import time
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from scipy.spatial import cKDTree
+import detections       # detection file reading and frame indexed detection store
+from detections import ID,XC,YC,DETECT_HEADER
+
+########## SETTINGS ##############################
+detectFileName='detection.csv'      # input, detections of every frame (.csv or .npy)
+trackFileName='track.csv'           # output, detections with track ID
+trackSummaryName='trackSummary.csv' # output, first frame, last frame and number of detections of every track
+MAX_DISTANCE=20         # objects further than this (pixels) from a track's predicted position are never matched to it
+MIN_GATE=3              # smallest gate (pixels) around a predicted position
+GATE_SIGMAS=3           # gate is this many standard deviations of the predicted position
+MEASURE_NOISE=1.0       # variance of detected object centers (pixels^2)
+ACCEL_NOISE=0.5         # variance of the change in speed per frame (pixels/frame)^2, how much objects swerve
+MAX_MISSED=2            # a track ends when it is not matched for more than this many frames
+NO_MATCH=1e9            # cost of a pair outside the gate, larger than any real distance
+KD_TREE_PAIRS=10000     # above this many track-object pairs only pairs inside the gate are found, with a KD tree
+SUMMARY_HEADER='TRACK,FIRST_FRAME,LAST_FRAME,POINTS'
+X=0; Y=1; VX=2; VY=3    # track state columns
+
+################# FUNCTIONS #################
+def distanceMatrix(xy1,xy2):
+    # distance between every point in xy1 (n,2) and every point in xy2 (m,2), returns (n,m)
+    diff=xy1[:,np.newaxis,:]-xy2[np.newaxis,:,:]
+    return(np.sqrt((diff*diff).sum(axis=2)))
+
+def matchPairs(cost,gate):
+    # best one to one matching of rows and columns of cost, pairs with cost above the gate of their row are not matched
+    gated=np.where(cost<=np.reshape(gate,(-1,1)),cost,NO_MATCH)
+    rows,cols=linear_sum_assignment(gated)
+    keep=gated[rows,cols]<NO_MATCH
+    return(rows[keep],cols[keep])
+
+def gatePairs(xy1,xy2,gate):
+    # (rows,cols,distances) of the points in xy1 and xy2 closer than the gate of the xy1 point, found with a KD tree
+    gate=np.broadcast_to(gate,(len(xy1),))
+    neighbours=cKDTree(xy2).query_ball_point(xy1,gate)
+    counts=np.array([len(n) for n in neighbours],dtype=np.int64)
+    rows=np.repeat(np.arange(len(xy1)),counts)
+    cols=np.concatenate(neighbours).astype(np.int64) if counts.sum()>0 else np.zeros(0,dtype=np.int64)
+    dist=np.sqrt(((xy1[rows]-xy2[cols])**2).sum(axis=1))
+    return(rows,cols,dist)
+
+def matchGroups(rows,cols,dist,n,m):
+    # best one to one matching of n rows and m columns using only the pairs given, each connected group matched on its own
+    if len(rows)==0:
+        return(rows,cols)
+    graph=coo_matrix((np.ones(len(rows)),(rows,n+cols)),shape=(n+m,n+m))   # rows are nodes 0..n-1, columns n..n+m-1
+    groupCount,group=connected_components(graph,directed=False)
+    pairGroup=group[rows]
+    pairsInGroup=np.bincount(pairGroup,minlength=groupCount)
+
+    # a group with one pair is one track and one object, they match
+    single=pairsInGroup[pairGroup]==1
+    matchRows=[rows[single]]; matchCols=[cols[single]]
+
+    # bigger groups, Hungarian algorithm on the group's own small cost matrix
+    order=np.flatnonzero(~single)
+    order=order[np.argsort(pairGroup[order],kind='stable')]
+    bounds=np.flatnonzero(np.diff(pairGroup[order]))+1
+    groups=np.split(order,bounds) if len(order)>0 else []
+    for pairs in groups:
+        groupRows,r=np.unique(rows[pairs],return_inverse=True)
+        groupCols,c=np.unique(cols[pairs],return_inverse=True)
+        cost=np.full((len(groupRows),len(groupCols)),NO_MATCH)
+        cost[r,c]=dist[pairs]
+        i,j=linear_sum_assignment(cost)
+        keep=cost[i,j]<NO_MATCH
+        matchRows.append(groupRows[i[keep]]); matchCols.append(groupCols[j[keep]])
+    return(np.concatenate(matchRows),np.concatenate(matchCols))
+
+def findMatches(xy1,xy2,gate):
+    # (rows,cols) of matched points, gate is one distance or one per xy1 point
+    # full distance matrix for few points, KD tree for many
+    if len(xy1)*len(xy2)<=KD_TREE_PAIRS:
+        return(matchPairs(distanceMatrix(xy1,xy2),np.broadcast_to(gate,(len(xy1),))))
+    rows,cols,dist=gatePairs(xy1,xy2,gate)
+    return(matchGroups(rows,cols,dist,len(xy1),len(xy2)))
+
+################# KALMAN FILTER #################
+def predictTracks(state,cov,dt,accelNoise=ACCEL_NOISE):
+    # constant velocity prediction of all tracks dt frames ahead, state (tracks,4), cov (tracks,4,4)
+    F=np.eye(4)
+    F[X,VX]=dt; F[Y,VY]=dt
+    G=np.array([[dt*dt/2,0],[0,dt*dt/2],[dt,0],[0,dt]])    # how a change in speed moves the state
+    Q=accelNoise*(G@G.T)
+    state=state@F.T
+    cov=F@cov@F.T+Q
+    return(state,cov)
+
+def updateTracks(state,cov,xy,measureNoise=MEASURE_NOISE):
+    # Kalman update of tracks (state (n,4), cov (n,4,4)) with their detected positions xy (n,2)
+    S=cov[:,:2,:2]+measureNoise*np.eye(2)         # uncertainty of the predicted position plus detection noise
+    K=cov[:,:,:2]@np.linalg.inv(S)                  # Kalman gain (n,4,2)
+    innovation=xy-state[:,:2]
+    state=state+(K@innovation[:,:,np.newaxis])[:,:,0]
+    cov=cov-K@cov[:,:2,:]
+    return(state,cov)
+
+def getGates(cov,maxDistance,measureNoise=MEASURE_NOISE):
+    # gate radius of every track, GATE_SIGMAS standard deviations of the predicted position, MIN_GATE to maxDistance
+    variance=np.maximum(cov[:,X,X],cov[:,Y,Y])+measureNoise
+    return(np.clip(GATE_SIGMAS*np.sqrt(variance),MIN_GATE,maxDistance))
+
+class Tracker:
+    def __init__(self,maxDistance=MAX_DISTANCE,maxMissed=MAX_MISSED,summaryFileName=None):
+        self.maxDistance=maxDistance
+        self.maxMissed=maxMissed
+        self.nextID=0                               # ID given to the next new track
+        self.frame=None                             # frame the track states are for
+        self.trackID=np.zeros(0,dtype=np.int64)     # ID of every active track
+        self.state=np.zeros((0,4))                  # x,y,vx,vy of every active track
+        self.cov=np.zeros((0,4,4))                  # covariance of every track state
+        self.lastFrame=np.zeros(0,dtype=np.int64)   # frame every active track was last matched
+        self.firstFrame=np.zeros(0,dtype=np.int64)  # frame every active track started
+        self.points=np.zeros(0,dtype=np.int64)      # detections matched to every active track
+        self.summaryFileName=summaryFileName
+        self.summaryFile=None           # opened when the first track ends
+        # a new track's speed is unknown, its velocity spread makes the first gate about maxDistance
+        speedVariance=(maxDistance/GATE_SIGMAS)**2
+        self.newCov=np.diag([MEASURE_NOISE,MEASURE_NOISE,speedVariance,speedVariance])
+
+    def predict(self,frame):
+        # move all track states to frame, returns predicted positions (tracks,2)
+        if self.frame is not None and frame!=self.frame:
+            self.state,self.cov=predictTracks(self.state,self.cov,frame-self.frame)
+        self.frame=frame
+        return(self.state[:,:2])
+
+    def update(self,frame,frameData):
+        # match the detections of one frame (n,MAX_COL) to the active tracks, returns track ID of every detection
+        xy=np.asarray(frameData[:,[XC,YC]],dtype=float)
+        ids=np.full(len(xy),-1,dtype=np.int64)
+        predicted=self.predict(frame)
+        if len(predicted)>0 and len(xy)>0:
+            rows,cols=findMatches(predicted,xy,getGates(self.cov,self.maxDistance))
+            ids[cols]=self.trackID[rows]
+            self.state[rows],self.cov[rows]=updateTracks(self.state[rows],self.cov[rows],xy[cols])
+            self.lastFrame[rows]=frame
+            self.points[rows]+=1
+
+        # objects without a track start new tracks, standing still until their speed is known
+        new=np.flatnonzero(ids<0)
+        ids[new]=np.arange(self.nextID,self.nextID+len(new))
+        self.nextID+=len(new)
+        newState=np.zeros((len(new),4))
+        newState[:,:2]=xy[new]
+        self.trackID=np.concatenate((self.trackID,ids[new]))
+        self.state=np.concatenate((self.state,newState))
+        self.cov=np.concatenate((self.cov,np.broadcast_to(self.newCov,(len(new),4,4))))
+        self.lastFrame=np.concatenate((self.lastFrame,np.full(len(new),frame,dtype=np.int64)))
+        self.firstFrame=np.concatenate((self.firstFrame,np.full(len(new),frame,dtype=np.int64)))
+        self.points=np.concatenate((self.points,np.ones(len(new),dtype=np.int64)))
+
+        # end tracks not seen for too long
+        self.keep(frame-self.lastFrame<=self.maxMissed)
+
+        frameData[:,ID]=ids
+        return(ids)
+
+    def keep(self,alive):
+        # keep the tracks where alive is True, the others have ended and are written to the summary file
+        if self.summaryFileName is not None and not np.all(alive):
+            if self.summaryFile is None:
+                self.summaryFile=open(self.summaryFileName,'w')
+                self.summaryFile.write('# '+SUMMARY_HEADER+'\n')   # same header line as np.savetxt
+            ended=~alive
+            summary=np.stack((self.trackID[ended],self.firstFrame[ended],self.lastFrame[ended],self.points[ended]),axis=1)
+            np.savetxt(self.summaryFile,summary,delimiter=',',fmt='%d')
+        self.trackID=self.trackID[alive]; self.state=self.state[alive]; self.cov=self.cov[alive]
+        self.lastFrame=self.lastFrame[alive]; self.firstFrame=self.firstFrame[alive]; self.points=self.points[alive]
+        return
+
+    def close(self):
+        # end all tracks
+        self.keep(np.zeros(len(self.trackID),dtype=bool))
+        if self.summaryFile is not None:
+            self.summaryFile.close()
+            self.summaryFile=None
+        return
+
+def trackFile(detectFileName,trackFileName,maxDistance=MAX_DISTANCE,maxMissed=MAX_MISSED,summaryFileName=None):
+    # track every frame of a detection file and save the detections with track IDs, returns the tracked rows
+    store=detections.DetectionStore(detectFileName)    # a .npy file is mapped copy on write, IDs are set in memory only
+    tracker=Tracker(maxDistance,maxMissed,summaryFileName)
+    for frame,frameData in store.iterFrames():
+        tracker.update(frame,frameData)
+    tracker.close()
+    np.savetxt(trackFileName,store.data,header=DETECT_HEADER,delimiter=',',fmt='%d')
+    print('Tracked',store.frameCount,'frames,',len(store),'detections,',tracker.nextID,'tracks')
+    return(store.data)
+
+################################ MAIN ##################################
+if __name__=='__main__':
+    startTime=time.time()
+    trackFile(detectFileName,trackFileName,summaryFileName=trackSummaryName)
+    print('Saved',trackFileName,'in',round(time.time()-startTime,1),'seconds')